@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 12:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_placeholder(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    User.objects.filter(object_dn=settings.LDAP_PLACEHOLDER_DN).update(is_placeholder=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_user_object_dn"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="is_placeholder",
+            field=models.BooleanField(
+                db_index=True, default=False, verbose_name="Placeholder"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="object_dn",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                max_length=150,
+                null=True,
+                verbose_name="LDAP DN",
+            ),
+        ),
+        migrations.RunPython(mark_placeholder, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import logging
 from typing import Optional
 
 from django.contrib.auth.models import AbstractUser
@@ -10,6 +11,8 @@ from django.utils.translation import gettext_lazy as _
 
 from gpnmgr import settings
 
+logger = logging.getLogger(__name__)
+
 
 class BaseUser(AbstractUser):
     class Meta:
@@ -26,7 +29,9 @@ class BaseUser(AbstractUser):
 
 class User(BaseUser):
     display_name = models.CharField(max_length=150, verbose_name=_('Display name'), null=True, blank=True)
-    object_dn = models.CharField(max_length=150, verbose_name=_('LDAP DN'), null=True, blank=True)
+    object_dn = models.CharField(max_length=150, verbose_name=_('LDAP DN'), null=True, blank=True, db_index=True)
+    # Stands in for the members of an otherwise empty LDAP group, see LDAP_GROUP_MEMBER_REQUIRED
+    is_placeholder = models.BooleanField(default=False, verbose_name=_('Placeholder'), db_index=True)
 
     class Meta:
         default_permissions = ()
@@ -60,3 +65,14 @@ class User(BaseUser):
     # Is no used
     def has_module_perms(self, app_label: str) -> bool:
         return False
+
+    @classmethod
+    def placeholder_pk(cls) -> Optional[int]:
+        """
+        Primary key of the placeholder user, None if it was not imported yet
+        """
+        pk = cls.objects.filter(is_placeholder=True).values_list('pk', flat=True).first()
+        if pk is None:
+            logger.error('There is no placeholder user, import the user %s from LDAP with `import_ldap_users`',
+                         settings.LDAP_PLACEHOLDER_DN)
+        return pk
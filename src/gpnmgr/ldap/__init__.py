@@ -0,0 +1,3 @@
+from .cache import GroupDNCache, group_dn_cache, resolve_group_dn
+from .pool import READ, WRITE, ConnectionPool, LdapPoolExhausted, close_pool, get_pool, ldap_connection
+from .suspend import suspend_sync, sync_suspended
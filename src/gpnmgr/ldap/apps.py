@@ -0,0 +1,5 @@
+from django.apps import AppConfig
+
+
+class LdapConfig(AppConfig):
+    name = 'gpnmgr.ldap'
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+from django.db import IntegrityError
+from ldap3 import Connection, SUBTREE
+from ldap3.utils.conv import escape_filter_chars
+
+
+class GroupDNCache:
+    """
+    Maps Team.ldap_name to the DN of its LDAP group.
+
+    Lookups hit an in-process dict first and fall back to an optional shared Django cache, so a DN resolved by one
+    worker (or the group importer) is visible to the others. Local and shared entries expire after `ttl` seconds.
+    """
+    key_prefix = 'ldap-group-dn:'
+
+    def __init__(self, ttl: float, shared_cache: Optional[str] = None) -> None:
+        self.ttl = ttl
+        self.shared_cache = shared_cache
+        self._entries: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _shared(self) -> Optional[BaseCache]:
+        return caches[self.shared_cache] if self.shared_cache else None
+
+    def get(self, ldap_name: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(ldap_name)
+        if entry is not None:
+            group_dn, expires = entry
+            if expires > time.monotonic():
+                return group_dn
+        shared = self._shared()
+        if shared is not None:
+            group_dn = shared.get(self.key_prefix + ldap_name)
+            if group_dn is not None:
+                self._store_local(ldap_name, group_dn)
+                return group_dn
+        return None
+
+    def _store_local(self, ldap_name: str, group_dn: str) -> None:
+        with self._lock:
+            self._entries[ldap_name] = (group_dn, time.monotonic() + self.ttl)
+
+    def set(self, ldap_name: str, group_dn: str) -> None:
+        self._store_local(ldap_name, group_dn)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(self.key_prefix + ldap_name, group_dn, timeout=self.ttl)
+
+    def invalidate(self, ldap_name: str) -> None:
+        with self._lock:
+            self._entries.pop(ldap_name, None)
+        shared = self._shared()
+        if shared is not None:
+            shared.delete(self.key_prefix + ldap_name)
+
+    def clear(self) -> None:
+        """
+        Drop all local entries and their shared counterparts. Shared entries only another process has resolved are not
+        known here and stay until they expire.
+        """
+        with self._lock:
+            ldap_names = list(self._entries)
+            self._entries.clear()
+        shared = self._shared()
+        if shared is not None and ldap_names:
+            shared.delete_many([self.key_prefix + ldap_name for ldap_name in ldap_names])
+
+
+group_dn_cache = GroupDNCache(settings.LDAP_GROUP_DN_CACHE_TTL, settings.LDAP_GROUP_DN_SHARED_CACHE or None)
+
+
+def resolve_group_dn(conn: Connection, ldap_name: str) -> str:
+    """
+    Return the DN of the group named `ldap_name`, searching LDAP only on a cache miss
+    """
+    group_dn = group_dn_cache.get(ldap_name)
+    if group_dn is not None:
+        return group_dn
+
+    conn.search(
+        search_base=f'{settings.LDAP_GROUP_OU},{settings.LDAP_BASE_DN}',
+        search_filter=f'(&(objectClass={settings.LDAP_GROUP_OBJECT_CLASS})(cn={escape_filter_chars(ldap_name)}))',
+        search_scope=SUBTREE,
+        attributes=[],
+    )
+
+    if len(conn.entries) == 0:
+        raise IntegrityError(
+            f'There is no group found in LDAP with the name {ldap_name}'
+        )
+
+    group_dn = conn.entries[0].entry_dn
+    group_dn_cache.set(ldap_name, group_dn)
+    return group_dn
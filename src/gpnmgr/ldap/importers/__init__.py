@@ -0,0 +1,3 @@
+from .groups import GroupImporter, GroupImportResult
+from .plan import Plan, PlanError
+from .users import UserImporter, UserImportResult
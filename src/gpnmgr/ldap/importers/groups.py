@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.db import connection, connections
+
+from gpnmgr.accounts.models import User
+from gpnmgr.teams.models import Team
+
+from .plan import Plan
+from .users import batches
+
+
+def normalize_dn(dn: str) -> str:
+    return ','.join(part.strip() for part in dn.split(',')).lower()
+
+
+class UserResolver:
+    """
+    Resolves member DNs to user ids from a single query over all users. Shared by the workers of a parallel import.
+    """
+
+    def __init__(self) -> None:
+        self.by_dn: dict[str, int] = {}
+        self.by_username: dict[str, int] = {}
+        self.usernames: dict[int, str] = {}
+        self._lock = threading.Lock()
+        for pk, username, object_dn in User.objects.values_list('pk', 'username', 'object_dn'):
+            self.by_username[username] = pk
+            self.usernames[pk] = username
+            if object_dn:
+                self.by_dn[normalize_dn(object_dn)] = pk
+
+    def load_usernames(self, pks: set[int]) -> None:
+        """
+        Adds the usernames of users created after the resolver
+        """
+        with self._lock:
+            unknown = pks - self.usernames.keys()
+            if unknown:
+                self.usernames.update(User.objects.filter(pk__in=unknown).values_list('pk', 'username'))
+
+    def usernames_of(self, pks: set[int]) -> list[str]:
+        with self._lock:
+            return [self.usernames[pk] for pk in pks]
+
+    def resolve(self, dn: str) -> Optional[int]:
+        pk = self.by_dn.get(normalize_dn(dn))
+        if pk is None:
+            # Users that were created before their DN was known, e.g. on first login
+            attribute, _, value = dn.split(',')[0].partition('=')
+            if attribute.strip().lower() == settings.LDAP_USER_PK.lower():
+                pk = self.by_username.get(value.strip())
+        return pk
+
+
+@dataclass
+class GroupImportResult:
+    groups: int = 0
+    created: list[str] = field(default_factory=list)
+    members_added: int = 0
+    members_removed: int = 0
+    admins_added: int = 0
+    admins_removed: int = 0
+    # (group, dn) of members and owners without a matching user
+    unresolved: list[tuple[str, str]] = field(default_factory=list)
+    # (group, dn) of owners that are no member of the group
+    non_member_admins: list[tuple[str, str]] = field(default_factory=list)
+    # Teams whose LDAP group is gone, only known after a full sweep
+    missing: list[str] = field(default_factory=list)
+    # The planned changes of a dry run
+    plan: Plan = field(default_factory=Plan)
+
+    def __str__(self) -> str:
+        return (f'{self.groups} groups, {len(self.created)} teams created, '
+                f'members +{self.members_added}/-{self.members_removed}, '
+                f'admins +{self.admins_added}/-{self.admins_removed}, '
+                f'{len(self.unresolved)} unresolved DNs, {len(self.non_member_admins)} owners without membership, '
+                f'{len(self.missing)} missing groups')
+
+    def merge(self, other: GroupImportResult) -> None:
+        self.groups += other.groups
+        self.created.extend(other.created)
+        self.members_added += other.members_added
+        self.members_removed += other.members_removed
+        self.admins_added += other.admins_added
+        self.admins_removed += other.admins_removed
+        self.unresolved.extend(other.unresolved)
+        self.non_member_admins.extend(other.non_member_admins)
+        self.missing.extend(other.missing)
+        self.plan.merge(other.plan)
+
+
+class GroupImporter:
+    """
+    Syncs LDAP groups into teams.
+
+    Members are resolved through an in-memory DN map. Groups are consumed in batches of `batch_size`, and for each
+    batch the differences to the current memberships are planned and applied in one transaction, with bulk writes to
+    the through tables. Dry runs collect the plans instead.
+
+    Plans are applied with the LDAP sync suspended, so the import is not echoed back to the directory. The through
+    tables are written directly, which does not fire m2m_changed, so audit log entries are written explicitly.
+    """
+
+    def __init__(self, batch_size: int = 500) -> None:
+        self.batch_size = batch_size
+
+    def run(self, entries: Iterable[tuple[str, dict[str, list]]], dry_run: bool = False,
+            full_sweep: bool = False, jobs: int = 1) -> GroupImportResult:
+        """
+        Imports `entries`. If the caller asserts they are the complete group OU (`full_sweep`), teams whose group has
+        been deleted are reported once all entries were read; they are kept, as deleting a team cannot be undone by the
+        next import.
+        """
+        result = GroupImportResult()
+        resolver = UserResolver()
+        seen: set[str] = set()
+        for batch, batch_result in self.import_batches(batches(entries, self.batch_size), resolver, dry_run, jobs):
+            result.merge(batch_result)
+            if full_sweep:
+                seen.update((attributes.get(settings.LDAP_GROUP_PK) or [None])[0] for _, attributes in batch)
+        if full_sweep:
+            result.missing = [
+                ldap_name for ldap_name in Team.objects.exclude(ldap_name=None).values_list('ldap_name', flat=True)
+                if ldap_name not in seen
+            ]
+        return result
+
+    def import_batches(self, entry_batches: Iterable[list], resolver: UserResolver, dry_run: bool,
+                       jobs: int) -> Iterator[tuple[list, GroupImportResult]]:
+        """
+        Imports the batches with `jobs` worker threads, yielding their results in order.
+
+        Every group is in exactly one batch and the teams are looked up by their unique LDAP name, so the workers
+        never touch the same rows. Each worker thread uses its own database connection. SQLite locks whole tables,
+        so reads of one worker fail while another one writes; there the batches are imported one after another.
+        """
+        if jobs <= 1 or connection.vendor == 'sqlite':
+            for batch in entry_batches:
+                yield batch, self.import_batch(batch, resolver, dry_run)
+            return
+
+        def work(batch: list) -> GroupImportResult:
+            try:
+                return self.import_batch(batch, resolver, dry_run)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='group-import') as executor:
+            pending: deque[tuple[list, Future]] = deque()
+            for batch in entry_batches:
+                pending.append((batch, executor.submit(work, batch)))
+                # Bounds the number of batches held in memory
+                if len(pending) >= 2 * jobs:
+                    batch, future = pending.popleft()
+                    yield batch, future.result()
+            for batch, future in pending:
+                yield batch, future.result()
+
+    def import_batch(self, entries: list[tuple[str, dict[str, list]]], resolver: UserResolver,
+                     dry_run: bool) -> GroupImportResult:
+        result = GroupImportResult()
+        plan = self.plan_batch(entries, resolver, result)
+        if dry_run:
+            result.plan = plan
+        elif plan:
+            plan.apply(self.batch_size)
+        return result
+
+    def plan_batch(self, entries: list[tuple[str, dict[str, list]]], resolver: UserResolver,
+                   result: GroupImportResult) -> Plan:
+        groups: dict[str, tuple[set[int], set[int]]] = {}
+        for dn, attributes in entries:
+            group_name = (attributes.get(settings.LDAP_GROUP_PK) or [None])[0]
+            if not group_name:
+                continue
+            members = self.resolve(group_name, attributes.get(settings.LDAP_GROUP_MEMBER_KEY, []), resolver, result)
+            owners = self.resolve(group_name, attributes.get(settings.LDAP_GROUP_MANAGER_KEY, []), resolver, result)
+            result.non_member_admins.extend((group_name, dn) for pk, dn in owners.items() if pk not in members)
+            groups[group_name] = (set(members), set(owners) & set(members))
+        result.groups += len(groups)
+
+        plan = Plan()
+        teams = dict(Team.objects.filter(ldap_name__in=groups).values_list('ldap_name', 'pk'))
+        plan.create_teams = [group_name for group_name in groups if group_name not in teams]
+        current = {field_name: self.current(field_name, teams.values()) for field_name in ('members', 'admins')}
+        resolver.load_usernames({pk for memberships in current.values() for pks in memberships.values() for pk in pks})
+
+        for group_name, wanted in groups.items():
+            team_id = teams.get(group_name)
+            for field_name, wanted_pks in zip(('members', 'admins'), wanted):
+                have = current[field_name].get(team_id, set()) if team_id is not None else set()
+                plan.change(group_name, field_name, resolver.usernames_of(wanted_pks - have),
+                            resolver.usernames_of(have - wanted_pks))
+
+        result.created.extend(plan.create_teams)
+        result.members_added += plan.count('members', 'add')
+        result.members_removed += plan.count('members', 'remove')
+        result.admins_added += plan.count('admins', 'add')
+        result.admins_removed += plan.count('admins', 'remove')
+        return plan
+
+    @staticmethod
+    def resolve(group_name: str, dns: list[str], resolver: UserResolver, result: GroupImportResult) -> dict[int, str]:
+        pks = {}
+        for dn in dns:
+            pk = resolver.resolve(dn)
+            if pk is None:
+                result.unresolved.append((group_name, dn))
+            else:
+                pks[pk] = dn
+        return pks
+
+    @staticmethod
+    def current(field_name: str, team_ids: Iterable[int]) -> dict[int, set[int]]:
+        """
+        Returns {team id: user ids} of the through table of Team.`field_name`
+        """
+        through = getattr(Team, field_name).through
+        memberships: dict[int, set[int]] = defaultdict(set)
+        for team_id, user_id in through.objects.filter(team__in=team_ids).values_list('team_id', 'user_id'):
+            memberships[team_id].add(user_id)
+        return memberships
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import IO, NamedTuple, Optional
+
+from auditlog.models import LogEntry
+from django.contrib.auth.hashers import make_password
+from django.db import connection, models, transaction
+
+from gpnmgr.accounts.models import BaseUser, User
+from gpnmgr.teams.models import Team
+
+from ..suspend import suspend_sync
+
+PLAN_VERSION = 1
+
+# Admins have to be members, so admins are removed before and added after members
+REMOVE_ORDER = ('admins', 'members')
+ADD_ORDER = ('members', 'admins')
+
+
+class UserRecord(NamedTuple):
+    """
+    The attributes of a user that are synced from LDAP
+    """
+    last_name: str
+    display_name: Optional[str]
+    object_dn: Optional[str]
+    is_placeholder: bool
+
+
+SYNCED_FIELDS = list(UserRecord._fields)
+
+
+class PlanError(Exception):
+    pass
+
+
+@dataclass
+class Plan:
+    """
+    The changes an import makes to the database, computed without writing anything.
+
+    Users are referenced by username and teams by LDAP name, so a plan can be stored as JSON, reviewed and applied
+    later with `manage.py ldap_apply_plan`. Applying skips changes that have already been made in the meantime.
+    """
+    create_users: dict[str, UserRecord] = field(default_factory=dict)
+    update_users: dict[str, UserRecord] = field(default_factory=dict)
+    # Users whose LDAP entry is gone
+    clear_dns: list[str] = field(default_factory=list)
+    create_teams: list[str] = field(default_factory=list)
+    # {ldap name: {'members'|'admins': {'add': [username, ...], 'remove': [username, ...]}}}
+    teams: dict[str, dict[str, dict[str, list[str]]]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.create_users or self.update_users or self.clear_dns or self.create_teams or self.teams)
+
+    def __str__(self) -> str:
+        return (f'{len(self.create_users)} users to create, {len(self.update_users)} to update, '
+                f'{len(self.clear_dns)} DNs to clear, {len(self.create_teams)} teams to create, '
+                f'members +{self.count("members", "add")}/-{self.count("members", "remove")}, '
+                f'admins +{self.count("admins", "add")}/-{self.count("admins", "remove")}')
+
+    def count(self, field_name: str, operation: str) -> int:
+        return sum(len(changes.get(field_name, {}).get(operation, [])) for changes in self.teams.values())
+
+    def change(self, ldap_name: str, field_name: str, added: list[str], removed: list[str]) -> None:
+        if added or removed:
+            self.teams.setdefault(ldap_name, {})[field_name] = {'add': sorted(added), 'remove': sorted(removed)}
+
+    def merge(self, other: Plan) -> None:
+        self.create_users.update(other.create_users)
+        self.update_users.update(other.update_users)
+        self.clear_dns.extend(other.clear_dns)
+        self.create_teams.extend(other.create_teams)
+        for ldap_name, changes in other.teams.items():
+            self.teams.setdefault(ldap_name, {}).update(changes)
+
+    def to_dict(self) -> dict:
+        return {
+            'version': PLAN_VERSION,
+            'users': {
+                'create': {username: record._asdict() for username, record in self.create_users.items()},
+                'update': {username: record._asdict() for username, record in self.update_users.items()},
+                'clear_dn': self.clear_dns,
+            },
+            'teams': {
+                'create': self.create_teams,
+                'change': self.teams,
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Plan:
+        if data.get('version') != PLAN_VERSION:
+            raise PlanError(f'Unsupported plan version {data.get("version")}')
+        users = data.get('users', {})
+        teams = data.get('teams', {})
+        return cls(
+            create_users={username: UserRecord(**record) for username, record in users.get('create', {}).items()},
+            update_users={username: UserRecord(**record) for username, record in users.get('update', {}).items()},
+            clear_dns=list(users.get('clear_dn', [])),
+            create_teams=list(teams.get('create', [])),
+            teams=teams.get('change', {}),
+        )
+
+    def dump(self, fp: IO[str]) -> None:
+        json.dump(self.to_dict(), fp, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, fp: IO[str]) -> Plan:
+        try:
+            return cls.from_dict(json.load(fp))
+        except (ValueError, TypeError, AttributeError) as e:
+            raise PlanError(f'Invalid plan: {e}') from e
+
+    def apply(self, batch_size: int = 500) -> None:
+        """
+        Makes the planned changes in one transaction, with the LDAP sync suspended
+        """
+        with transaction.atomic(), suspend_sync():
+            self.apply_users(batch_size)
+            self.apply_teams(batch_size)
+
+    def apply_users(self, batch_size: int) -> None:
+        usernames = [*self.create_users, *self.update_users, *self.clear_dns]
+        if not usernames:
+            return
+        existing = dict(User.objects.filter(username__in=usernames).values_list('username', 'pk'))
+
+        create_users({username: record for username, record in self.create_users.items() if username not in existing},
+                     batch_size)
+        User.objects.bulk_update([
+            User(pk=existing[username], baseuser_ptr_id=existing[username], **record._asdict())
+            for username, record in self.update_users.items() if username in existing
+        ], SYNCED_FIELDS, batch_size=batch_size)
+        # Names are shown in the cached team fragments, and bulk_update() sends no signals
+        updated = [existing[username] for username in self.update_users if username in existing]
+        for start in range(0, len(updated), batch_size):
+            Team.objects.filter(members__in=updated[start:start + batch_size]).bump_version()
+        cleared = [existing[username] for username in self.clear_dns if username in existing]
+        for start in range(0, len(cleared), batch_size):
+            User.objects.filter(pk__in=cleared[start:start + batch_size]).update(object_dn=None)
+
+    def apply_teams(self, batch_size: int) -> None:
+        if not (self.create_teams or self.teams):
+            return
+        teams = {team.ldap_name: team for team in Team.objects.filter(ldap_name__in=[*self.create_teams, *self.teams])}
+        for team in Team.objects.bulk_create([
+            Team(ldap_name=ldap_name, slug=ldap_name, name=ldap_name)
+            for ldap_name in self.create_teams if ldap_name not in teams
+        ], batch_size=batch_size):
+            LogEntry.objects.log_create(team, force_log=True, action=LogEntry.Action.CREATE)
+            teams[team.ldap_name] = team
+
+        usernames = {
+            username
+            for changes in self.teams.values() for field_changes in changes.values()
+            for names in field_changes.values() for username in names
+        }
+        pks = dict(User.objects.filter(username__in=usernames).values_list('username', 'pk'))
+
+        def resolve(ldap_name: str, field_name: str, operation: str) -> set[int]:
+            return {
+                pks[username] for username in self.teams[ldap_name].get(field_name, {}).get(operation, [])
+                if username in pks
+            }
+
+        changed = [ldap_name for ldap_name in self.teams if ldap_name in teams]
+        for field_name in REMOVE_ORDER:
+            through = getattr(Team, field_name).through
+            for ldap_name in changed:
+                removed = resolve(ldap_name, field_name, 'remove')
+                if removed and through.objects.filter(team=teams[ldap_name], user_id__in=removed).delete()[0]:
+                    log(teams[ldap_name], field_name, 'delete', removed)
+        for field_name in ADD_ORDER:
+            through = getattr(Team, field_name).through
+            added = {ldap_name: resolve(ldap_name, field_name, 'add') for ldap_name in changed}
+            through.objects.bulk_create([
+                through(team=teams[ldap_name], user_id=user_id)
+                for ldap_name, user_ids in added.items() for user_id in user_ids
+            ], batch_size=batch_size, ignore_conflicts=True)
+            for ldap_name, user_ids in added.items():
+                if user_ids:
+                    log(teams[ldap_name], field_name, 'add', user_ids)
+        # The through rows are written directly, so the m2m_changed hooks don't invalidate the cached fragments
+        changed_ids = [teams[ldap_name].pk for ldap_name in changed]
+        for start in range(0, len(changed_ids), batch_size):
+            Team.objects.filter(pk__in=changed_ids[start:start + batch_size]).bump_version()
+
+
+def create_users(records: dict[str, UserRecord], batch_size: int) -> None:
+    # bulk_create() refuses multi-table inherited models, so the parent rows are bulk inserted and the User rows
+    # inserted into the child table alone, like loaddata does for inherited models
+    base_users = BaseUser.objects.bulk_create([
+        BaseUser(username=username, last_name=record.last_name, password=make_password(None))
+        for username, record in records.items()
+    ], batch_size=batch_size)
+    insert_local_rows(User, [
+        User(pk=base_user.pk, baseuser_ptr_id=base_user.pk, username=base_user.username, password=base_user.password,
+             **record._asdict())
+        for base_user, record in zip(base_users, records.values())
+    ], batch_size)
+
+
+def insert_local_rows(model: type[models.Model], objs: list[models.Model], batch_size: int) -> None:
+    """
+    Inserts only the table of `model` itself, not those of its parents, with one multi-row INSERT per batch
+    """
+    if not objs:
+        return
+    fields = model._meta.local_concrete_fields
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    row = f'({", ".join(["%s"] * len(fields))})'
+    batch_size = max(1, min(batch_size, connection.ops.bulk_batch_size(fields, objs)))
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            params = [field.get_db_prep_save(field.pre_save(obj, True), connection)
+                      for obj in batch for field in fields]
+            cursor.execute(f'INSERT INTO {table} ({columns}) VALUES {", ".join([row] * len(batch))}', params)
+
+
+def log(team: Team, field_name: str, operation: str, user_ids: set[int]) -> None:
+    LogEntry.objects.log_m2m_changes(User.objects.filter(pk__in=user_ids), team, operation, field_name)
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Iterable, Iterator, Optional, TypeVar
+
+from django.conf import settings
+
+from gpnmgr.accounts.models import User
+
+from .plan import SYNCED_FIELDS, Plan, UserRecord
+
+T = TypeVar('T')
+
+
+def batches(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@dataclass
+class UserImportResult:
+    created: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    unchanged: int = 0
+    skipped: list[str] = field(default_factory=list)
+    # Users whose LDAP entry is gone, only known after a full sweep
+    missing: list[str] = field(default_factory=list)
+    # The planned changes of a dry run
+    plan: Plan = field(default_factory=Plan)
+
+    def __str__(self) -> str:
+        return (f'{len(self.created)} created, {len(self.updated)} updated, {self.unchanged} unchanged, '
+                f'{len(self.skipped)} skipped, {len(self.missing)} missing')
+
+
+class UserImporter:
+    """
+    Syncs LDAP user entries into the user table with a constant number of queries per batch.
+
+    Entries are consumed in batches of `batch_size`: the existing users of a batch are loaded with one query and
+    compared in memory, which results in a plan of the new and changed users. The plan of each batch is applied with
+    bulk inserts and updates in its own transaction before the next batch is read, so memory does not grow with the
+    directory. Dry runs collect the plans instead.
+    """
+
+    def __init__(self, batch_size: int = 500) -> None:
+        self.batch_size = batch_size
+
+    @staticmethod
+    def record(dn: str, attributes: dict[str, list]) -> tuple[Optional[str], UserRecord]:
+        username = (attributes.get(settings.LDAP_USER_PK) or [None])[0]
+        last_name = (attributes.get('sn') or [None])[0]
+        return username, UserRecord(
+            last_name=last_name or '',
+            display_name=last_name or None,
+            object_dn=dn,
+            is_placeholder=dn == settings.LDAP_PLACEHOLDER_DN,
+        )
+
+    def run(self, entries: Iterable[tuple[str, dict[str, list]]], dry_run: bool = False,
+            full_sweep: bool = False) -> UserImportResult:
+        """
+        Imports `entries`. If the caller asserts they are the complete user OU (`full_sweep`), users whose entry has
+        been deleted lose their DN, so they are no longer resolved as group members. This only happens after `entries`
+        are exhausted: a failed or truncated search raises out of the loop instead, see paged_search().
+        """
+        result = UserImportResult()
+        seen: set[str] = set()
+        for batch in batches(entries, self.batch_size):
+            self.execute(self.plan_batch(batch, result), result, dry_run)
+            if full_sweep:
+                for dn, attributes in batch:
+                    username = self.record(dn, attributes)[0]
+                    if username:
+                        seen.add(username)
+        if full_sweep:
+            self.execute(self.plan_sweep(seen, result), result, dry_run)
+        return result
+
+    def execute(self, plan: Plan, result: UserImportResult, dry_run: bool) -> None:
+        if dry_run:
+            result.plan.merge(plan)
+        elif plan:
+            plan.apply(self.batch_size)
+
+    def plan_batch(self, entries: list[tuple[str, dict[str, list]]], result: UserImportResult) -> Plan:
+        records: dict[str, UserRecord] = {}
+        for dn, attributes in entries:
+            username, record = self.record(dn, attributes)
+            if not username:
+                result.skipped.append(dn)
+                continue
+            records[username] = record
+
+        existing = {
+            username: UserRecord(*values)
+            for username, *values in User.objects.filter(username__in=records)
+            .values_list('username', *SYNCED_FIELDS)
+        }
+
+        plan = Plan()
+        for username, record in records.items():
+            if username not in existing:
+                plan.create_users[username] = record
+            elif existing[username] == record:
+                result.unchanged += 1
+            else:
+                plan.update_users[username] = record
+        result.created.extend(plan.create_users)
+        result.updated.extend(plan.update_users)
+        return plan
+
+    @staticmethod
+    def plan_sweep(seen: set[str], result: UserImportResult) -> Plan:
+        missing = [
+            username
+            for username in User.objects.exclude(object_dn=None).filter(is_placeholder=False)
+            .values_list('username', flat=True)
+            if username not in seen
+        ]
+        result.missing = missing
+        return Plan(clear_dns=list(missing))
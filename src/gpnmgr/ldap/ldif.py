@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import logging
+from typing import Iterable, Iterator, Optional
+
+from ldap3.utils.ciDict import CaseInsensitiveDict
+
+from .importers.groups import normalize_dn
+
+logger = logging.getLogger(__name__)
+
+Entry = tuple[str, dict[str, list]]
+
+
+class LdifError(ValueError):
+    pass
+
+
+def unfold(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Joins continuation lines, which start with a single space, to the line before them
+    """
+    current: Optional[str] = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith(' ') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def parse_line(line: str) -> Optional[tuple[str, str]]:
+    name, separator, value = line.partition(':')
+    if not separator:
+        raise LdifError(f'Invalid LDIF line: {line[:80]}')
+    if value.startswith(':'):
+        try:
+            value = base64.b64decode(value[1:].strip(), validate=True).decode('utf-8', errors='replace')
+        except binascii.Error as e:
+            raise LdifError(f'Invalid base64 value of {name}: {e}') from e
+    elif value.startswith('<'):
+        # Values referenced by URL are not supported
+        logger.warning('Skipping %s given by URL', name)
+        return None
+    else:
+        value = value.lstrip(' ')
+    return name.strip(), value
+
+
+def parse_record(lines: list[str]) -> Optional[Entry]:
+    pairs = [pair for pair in map(parse_line, lines) if pair is not None]
+    if pairs and pairs[0][0].lower() == 'version':
+        pairs = pairs[1:]
+    # Not an entry, e.g. the search result summary of ldapsearch
+    if not pairs or pairs[0][0].lower() != 'dn':
+        return None
+
+    dn = pairs[0][1]
+    attributes = CaseInsensitiveDict()
+    for name, value in pairs[1:]:
+        if name.lower() == 'changetype':
+            if value.strip().lower() != 'add':
+                return None
+            continue
+        attributes.setdefault(name, []).append(value)
+    return dn, attributes
+
+
+def read_ldif(lines: Iterable[str]) -> Iterator[Entry]:
+    """
+    Yields the entries of an LDIF file (RFC 2849) or of ldapsearch output one at a time.
+
+    Comments, the version line, search result summaries and change records other than adds are skipped.
+    """
+    record: list[str] = []
+    for line in unfold(lines):
+        if line.startswith('#'):
+            continue
+        if line.strip():
+            record.append(line)
+            continue
+        if record:
+            entry = parse_record(record)
+            if entry is not None:
+                yield entry
+            record = []
+    if record:
+        entry = parse_record(record)
+        if entry is not None:
+            yield entry
+
+
+def search_ldif(lines: Iterable[str], search_base: str, object_class: str) -> Iterator[Entry]:
+    """
+    Yields the entries below `search_base` with `object_class`, like the subtree search of a live import
+    """
+    suffix = ',' + normalize_dn(search_base)
+    object_class = object_class.lower()
+    for dn, attributes in read_ldif(lines):
+        if not normalize_dn(dn).endswith(suffix):
+            continue
+        if object_class not in (value.lower() for value in attributes.get('objectClass', [])):
+            continue
+        yield dn, attributes
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from gpnmgr.ldap.importers import Plan, PlanError
+
+
+class Command(BaseCommand):
+    help = 'Apply plans written by import_ldap_users --plan and import_ldap_groups --plan in one transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('plan_files', nargs='+', metavar='FILE', help='Plans to apply, users before groups')
+        parser.add_argument('--batch-size', type=int, default=settings.LDAP_IMPORT_BATCH_SIZE,
+                            help='Number of rows per bulk insert or update')
+
+    def handle(self, *args, plan_files, batch_size, **options):
+        plan = Plan()
+        for plan_file in plan_files:
+            try:
+                with open(plan_file) as fp:
+                    plan.merge(Plan.load(fp))
+            except (OSError, PlanError) as e:
+                raise CommandError(f'Could not read {plan_file}: {e}')
+
+        plan.apply(batch_size)
+        print(f'Applied plan: {plan}')
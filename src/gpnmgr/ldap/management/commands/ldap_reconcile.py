@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from gpnmgr.ldap.reconcile import Drift, Reconciler
+from gpnmgr.ldap.search import paged_search, prefetch
+
+
+class Command(BaseCommand):
+    help = 'Compare team memberships with the LDAP groups and report or repair the drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Queue the changes that make the groups match the teams in the outbox')
+        parser.add_argument('--batch-size', type=int, default=settings.LDAP_IMPORT_BATCH_SIZE,
+                            help='Maximum number of values per repairing modify')
+        parser.add_argument('--page-size', type=int, default=settings.LDAP_SEARCH_PAGE_SIZE,
+                            help='Number of groups per LDAP search page')
+
+    def handle(self, *args, repair, batch_size, page_size, verbosity, **options):
+        pages = prefetch(paged_search(
+            search_base=f'{settings.LDAP_GROUP_OU},{settings.LDAP_BASE_DN}',
+            search_filter=f'(objectClass={settings.LDAP_GROUP_OBJECT_CLASS})',
+            attributes=[
+                settings.LDAP_GROUP_PK,
+                settings.LDAP_GROUP_MEMBER_KEY,
+                settings.LDAP_GROUP_MANAGER_KEY,
+            ],
+            page_size=page_size,
+        ))
+
+        def report(drift: Drift) -> None:
+            print(f'{drift.team}: {drift}')
+            if verbosity > 1:
+                for attribute, dns in drift.missing.items():
+                    for dn in dns:
+                        print(f'  {attribute} missing in LDAP: {dn}')
+                for attribute, dns in drift.extra.items():
+                    for dn in dns:
+                        print(f'  {attribute} only in LDAP: {dn}')
+
+        result = Reconciler(batch_size).run(pages, repair=repair, report=report)
+
+        for group_name in result.pending:
+            print(f'Skipped {group_name}, it has pending LDAP changes')
+        for group_name in result.missing:
+            print(f'Group not in LDAP: {group_name}')
+
+        print(f'Reconcile complete: {result}')
@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+from gpnmgr.ldap.pool import READ, WRITE, server_urls
+from gpnmgr.ldap.schema import refresh_schema, schema_files
+
+
+class Command(BaseCommand):
+    help = 'Read schema and server info from every LDAP server and store them for all processes to load'
+
+    def handle(self, *args, **options):
+        for url in dict.fromkeys(server_urls(WRITE) + server_urls(READ)):
+            server = refresh_schema(url)
+            info_file, schema_file = schema_files(url)
+            print(f'Stored server info of {server.host} in {info_file} and schema in {schema_file}.')
@@ -0,0 +1,59 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from gpnmgr.ldap.models import OutboxEntry
+from gpnmgr.ldap.outbox import drain, purge
+from gpnmgr.ldap.resilience import breakers
+from gpnmgr.teams.models import Team
+
+
+class Command(BaseCommand):
+    help = 'Apply pending LDAP changes from the outbox. Run a single instance of this command.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.LDAP_OUTBOX_BATCH_SIZE,
+                            help='Number of entries to handle per batch')
+        parser.add_argument('--interval', type=float, default=settings.LDAP_OUTBOX_POLL_INTERVAL,
+                            help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+        parser.add_argument('--status', action='store_true', help='Print the sync status per team and exit')
+        parser.add_argument('--retry-abandoned', action='store_true',
+                            help='Queue the entries abandoned after LDAP_OUTBOX_MAX_ATTEMPTS failures again and exit')
+
+    def handle(self, *args, batch_size, interval, once, status, retry_abandoned, **options):
+        if status:
+            self.print_status()
+            return
+        if retry_abandoned:
+            count = OutboxEntry.objects.abandoned().update(
+                abandoned_at=None, attempts=0, next_attempt_at=timezone.now())
+            print(f'Queued {count} abandoned LDAP changes again.')
+            return
+
+        while True:
+            applied, failed = drain(batch_size)
+            if applied or failed:
+                print(f'Applied {applied} and failed {failed} LDAP changes.')
+            for role, breaker in breakers.items():
+                if breaker.state != breaker.CLOSED:
+                    print(f'LDAP {role} circuit breaker is {breaker.state} (tripped {breaker.trips} times).')
+            purge(timedelta(days=settings.LDAP_OUTBOX_RETENTION_DAYS))
+            if once and applied < batch_size:
+                break
+            if applied + failed < batch_size:
+                time.sleep(interval)
+
+    @staticmethod
+    def print_status():
+        team_ids = OutboxEntry.objects.filter(processed_at__isnull=True).values_list('team', flat=True).distinct()
+        teams = Team.objects.filter(pk__in=team_ids)
+        if not teams:
+            print('All teams are in sync.')
+        for team in teams:
+            sync_status = team.ldap_sync_status
+            print(f'{team}: {sync_status.pending} pending, {sync_status.failing} failing, '
+                  f'{sync_status.abandoned} abandoned, lag {sync_status.lag}')
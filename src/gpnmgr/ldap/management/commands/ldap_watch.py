@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from gpnmgr.ldap.watch import DirectoryWatcher
+
+
+class Command(BaseCommand):
+    help = 'Apply changes made in LDAP as they happen. Run a single instance of this command.'
+
+    def handle(self, *args, **options):
+        watcher = DirectoryWatcher()
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.stop()
+            print('Stopped watching LDAP.')
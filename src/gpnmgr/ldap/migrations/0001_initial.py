@@ -0,0 +1,77 @@
+# Generated by Django 6.0 on 2026-10-18 11:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("teams", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "group_name",
+                    models.CharField(max_length=255, verbose_name="LDAP Name"),
+                ),
+                ("changes", models.JSONField(default=dict, verbose_name="Changes")),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(default=0, verbose_name="Attempts"),
+                ),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Next attempt"
+                    ),
+                ),
+                (
+                    "processed_at",
+                    models.DateTimeField(
+                        default=None, null=True, verbose_name="Processed at"
+                    ),
+                ),
+                (
+                    "last_error",
+                    models.TextField(blank=True, default="", verbose_name="Last error"),
+                ),
+                (
+                    "team",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ldap_outbox",
+                        to="teams.team",
+                        verbose_name="Team",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "LDAP outbox entry",
+                "verbose_name_plural": "LDAP outbox entries",
+                "ordering": ["id"],
+                "default_permissions": (),
+                "indexes": [
+                    models.Index(
+                        fields=["processed_at", "id"], name="ldap_outbox_pending_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ldap", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncWatermark",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(max_length=32, unique=True, verbose_name="Source"),
+                ),
+                (
+                    "modified_at",
+                    models.DateTimeField(
+                        default=None, null=True, verbose_name="Modified at"
+                    ),
+                ),
+                (
+                    "full_sync_at",
+                    models.DateTimeField(
+                        default=None, null=True, verbose_name="Last full sync"
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "LDAP sync watermark",
+                "verbose_name_plural": "LDAP sync watermarks",
+                "default_permissions": (),
+            },
+        ),
+    ]
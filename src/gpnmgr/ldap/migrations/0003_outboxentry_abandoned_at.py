@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ldap", "0002_syncwatermark"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxentry",
+            name="abandoned_at",
+            field=models.DateTimeField(
+                default=None, null=True, verbose_name="Abandoned at"
+            ),
+        ),
+    ]
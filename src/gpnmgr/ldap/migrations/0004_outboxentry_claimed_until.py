@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ldap", "0003_outboxentry_abandoned_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxentry",
+            name="claimed_until",
+            field=models.DateTimeField(
+                default=None, null=True, verbose_name="Claimed until"
+            ),
+        ),
+    ]
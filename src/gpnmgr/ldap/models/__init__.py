@@ -0,0 +1,2 @@
+from .outbox import OutboxEntry, SyncStatus
+from .watermark import SyncWatermark
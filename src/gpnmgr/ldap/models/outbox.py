@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.db import models
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+@dataclass
+class SyncStatus:
+    pending: int
+    failing: int
+    oldest: Optional[datetime]
+    abandoned: int = 0
+
+    @property
+    def in_sync(self) -> bool:
+        return self.pending == 0 and self.abandoned == 0
+
+    @property
+    def lag(self) -> Optional[timedelta]:
+        if self.oldest is None:
+            return None
+        return timezone.now() - self.oldest
+
+
+class OutboxQuerySet(models.QuerySet):
+    def pending(self) -> OutboxQuerySet:
+        return self.filter(processed_at__isnull=True, abandoned_at__isnull=True)
+
+    def claimable(self, now: datetime) -> OutboxQuerySet:
+        return self.pending().filter(Q(claimed_until__isnull=True) | Q(claimed_until__lte=now))
+
+    def abandoned(self) -> OutboxQuerySet:
+        return self.filter(processed_at__isnull=True, abandoned_at__isnull=False)
+
+    def status(self) -> SyncStatus:
+        pending = Q(abandoned_at__isnull=True)
+        result = self.filter(processed_at__isnull=True).aggregate(
+            pending=Count('id', filter=pending),
+            failing=Count('id', filter=pending & Q(attempts__gt=0)),
+            oldest=Min('created_at', filter=pending),
+            abandoned=Count('id', filter=~pending),
+        )
+        return SyncStatus(**result)
+
+
+class OutboxEntry(models.Model):
+    """
+    A pending LDAP modification of a team's group.
+
+    Entries are written in the same transaction as the membership change and applied to the directory by the
+    `ldap_sync_outbox` command, strictly in id order per group. A worker claims the entries it is about to apply until
+    `claimed_until`, so others skip them without holding a transaction open. An entry that still fails after
+    LDAP_OUTBOX_MAX_ATTEMPTS is abandoned: it is kept for inspection, but no longer retried or waited for.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    team = models.ForeignKey('teams.Team', verbose_name=_('Team'), related_name='ldap_outbox', on_delete=models.CASCADE)
+    group_name = models.CharField(_('LDAP Name'), max_length=255)
+    # {attribute: {'add': [dn, ...], 'delete': [dn, ...]}}
+    changes = models.JSONField(_('Changes'), default=dict)
+
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    next_attempt_at = models.DateTimeField(_('Next attempt'), default=timezone.now)
+    processed_at = models.DateTimeField(_('Processed at'), default=None, null=True)
+    abandoned_at = models.DateTimeField(_('Abandoned at'), default=None, null=True)
+    claimed_until = models.DateTimeField(_('Claimed until'), default=None, null=True)
+    last_error = models.TextField(_('Last error'), blank=True, default='')
+
+    objects = OutboxQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _('LDAP outbox entry')
+        verbose_name_plural = _('LDAP outbox entries')
+        default_permissions = ()
+        indexes = [
+            models.Index(fields=['processed_at', 'id'], name='ldap_outbox_pending_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.group_name} #{self.pk}'
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from ldap3 import BASE, MODIFY_ADD, MODIFY_DELETE, Connection
+from ldap3.core.exceptions import LDAPException
+
+from gpnmgr.teams.models import Team
+
+from . import resilience
+from .cache import group_dn_cache, resolve_group_dn
+from .importers.groups import normalize_dn
+from .models import OutboxEntry
+from .pool import READ, WRITE
+from .resilience import CircuitOpen
+from .search import normalize_attributes
+from .suspend import sync_suspended
+
+logger = logging.getLogger(__name__)
+
+# Permissive modify: adding an existing value or deleting a missing one is not an error, which makes retries safe.
+# It is sent as non-critical, so servers without it reject the whole modify with one of
+# noSuchAttribute, attributeOrValueExists
+PERMISSIVE_MODIFY_CONTROL = ('1.2.840.113556.1.4.1413', False, None)
+NOT_PERMISSIVE_RESULTS = (16, 20)
+
+
+class OutboxError(Exception):
+    pass
+
+
+class ChangeBuffer(threading.local):
+    """
+    Outbox entries written by the current thread's transaction, one per team.
+
+    Every further change of a team within the same transaction is merged into its entry, so a request that
+    e.g. removes an admin ends up as a single modify of the group carrying both the member and the owner delta.
+    """
+
+    def __init__(self) -> None:
+        self.entries: dict[Any, OutboxEntry] = {}
+        self.callback: Optional[Callable[[], None]] = None
+
+    def reset(self) -> None:
+        self.entries = {}
+        self.callback = None
+
+    def current(self) -> dict[Any, OutboxEntry]:
+        # Django drops pending on_commit callbacks on rollback, so a missing callback means the entries are gone too
+        if self.callback is not None and not any(
+                func is self.callback for _, func, _ in transaction.get_connection().run_on_commit):
+            self.reset()
+        return self.entries
+
+
+_buffer = ChangeBuffer()
+
+
+def merge(changes: dict[str, dict[str, list[str]]], attribute: str, add: Iterable[str], delete: Iterable[str]) -> None:
+    delta = changes.setdefault(attribute, {'add': [], 'delete': []})
+    for dn in add:
+        if dn in delta['delete']:
+            delta['delete'].remove(dn)
+        elif dn not in delta['add']:
+            delta['add'].append(dn)
+    for dn in delete:
+        if dn in delta['add']:
+            delta['add'].remove(dn)
+        elif dn not in delta['delete']:
+            delta['delete'].append(dn)
+
+
+def enqueue(team: Team, attribute: str, add: Iterable[str] = (), delete: Iterable[str] = ()) -> OutboxEntry | None:
+    """
+    Record a modification of the team's group. Must be called inside the transaction that changes the membership.
+    """
+    if sync_suspended():
+        return None
+    add = list(add)
+    delete = list(delete)
+    if not team.ldap_name or not (add or delete):
+        return None
+
+    entries = _buffer.current()
+    entry = entries.get(team.pk)
+    if entry is None:
+        entry = OutboxEntry(team=team, group_name=team.ldap_name)
+    merge(entry.changes, attribute, add, delete)
+    entry.save()
+    entries[team.pk] = entry
+
+    if _buffer.callback is None:
+        _buffer.callback = flush
+        transaction.on_commit(flush)
+    return entry
+
+
+def flush() -> None:
+    """
+    Called on commit. Optionally sends the coalesced entries right away instead of waiting for the worker.
+    """
+    entries = list(_buffer.entries.values())
+    _buffer.reset()
+    if not settings.LDAP_SYNC_ON_COMMIT:
+        return
+    for entry in entries:
+        if OutboxEntry.objects.pending().filter(group_name=entry.group_name, id__lt=entry.id).exists():
+            # Keep the order of the group, the worker will pick it up
+            continue
+        entry.claimed_until = claim_deadline()
+        if not OutboxEntry.objects.claimable(timezone.now()).filter(pk=entry.pk).update(
+                claimed_until=entry.claimed_until):
+            # A worker got to it first
+            continue
+        try:
+            process(entry)
+        except CircuitOpen:
+            release([entry])
+            return
+
+
+def modification(changes: dict[str, dict[str, list[str]]]) -> dict[str, list[tuple]]:
+    modlist: dict[str, list[tuple]] = {}
+    for attribute, delta in changes.items():
+        operations = []
+        if delta.get('add'):
+            operations.append((MODIFY_ADD, delta['add']))
+        if delta.get('delete'):
+            operations.append((MODIFY_DELETE, delta['delete']))
+        if operations:
+            modlist[attribute] = operations
+    return modlist
+
+
+def effective_changes(conn: Connection, group_dn: str, changes: dict[str, dict[str, list[str]]]
+                      ) -> dict[str, dict[str, list[str]]]:
+    """
+    Returns `changes` without the adds of values the group already has and the deletes of values it doesn't have
+    """
+    conn.search(group_dn, '(objectClass=*)', search_scope=BASE, attributes=list(changes))
+    entry = next((response for response in conn.response if response['type'] == 'searchResEntry'), None)
+    if entry is None:
+        raise OutboxError(f'Group {group_dn} not found: {conn.result.get("description")}')
+    attributes = normalize_attributes(group_dn, entry['attributes'])
+
+    effective = {}
+    for attribute, delta in changes.items():
+        present = {normalize_dn(dn) for dn in attributes.get(attribute, [])}
+        effective[attribute] = {
+            'add': [dn for dn in delta.get('add', []) if normalize_dn(dn) not in present],
+            'delete': [dn for dn in delta.get('delete', []) if normalize_dn(dn) in present],
+        }
+    return effective
+
+
+def apply(entry: OutboxEntry) -> None:
+    modlist = modification(entry.changes)
+    if not modlist:
+        return
+
+    group_dn = group_dn_cache.get(entry.group_name) or resilience.call(
+        lambda conn: resolve_group_dn(conn, entry.group_name), role=READ)
+
+    def modify(conn: Connection) -> None:
+        if conn.modify(group_dn, modlist, controls=[PERMISSIVE_MODIFY_CONTROL]):
+            return
+        if conn.result.get('result') in NOT_PERMISSIVE_RESULTS:
+            # The control was ignored: retry with only the values that still make a difference
+            remaining = modification(effective_changes(conn, group_dn, entry.changes))
+            if not remaining or conn.modify(group_dn, remaining):
+                return
+        raise OutboxError(f'{conn.result.get("description")}: {conn.result.get("message")}')
+
+    resilience.call(modify, role=WRITE)
+
+
+def backoff(attempts: int) -> timedelta:
+    delay = settings.LDAP_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.LDAP_OUTBOX_MAX_RETRY_DELAY))
+
+
+def claim_deadline() -> datetime:
+    return timezone.now() + timedelta(seconds=settings.LDAP_OUTBOX_CLAIM_TIMEOUT)
+
+
+def process(entry: OutboxEntry) -> bool:
+    """
+    Apply a claimed entry and record the outcome. Raises CircuitOpen without touching the entry while LDAP is
+    unavailable.
+
+    Must not be called inside a transaction: the directory is written first and each outcome is then saved on its own.
+    """
+    try:
+        apply(entry)
+    except CircuitOpen:
+        raise
+    except (LDAPException, OutboxError, IntegrityError) as e:
+        entry.attempts += 1
+        entry.last_error = str(e)
+        entry.next_attempt_at = timezone.now() + backoff(entry.attempts)
+        if entry.attempts >= settings.LDAP_OUTBOX_MAX_ATTEMPTS:
+            entry.abandoned_at = timezone.now()
+            logger.error('Abandoned syncing %s to LDAP after %d attempts: %s', entry, entry.attempts, e)
+        else:
+            logger.warning('Could not sync %s to LDAP (attempt %d): %s', entry, entry.attempts, e)
+        entry.claimed_until = None
+        entry.save(update_fields=['attempts', 'last_error', 'next_attempt_at', 'abandoned_at', 'claimed_until'])
+        return False
+    entry.processed_at = timezone.now()
+    entry.claimed_until = None
+    entry.save(update_fields=['processed_at', 'claimed_until'])
+    return True
+
+
+def claim(batch_size: int) -> list[OutboxEntry]:
+    """
+    Claim up to `batch_size` due entries for this worker and return them in id order.
+
+    Groups with an entry waiting for a retry or claimed by another worker are left out, and an entry is only claimed
+    along with the earlier pending entries of its group. The rows are locked only until the claim is committed.
+    """
+    now = timezone.now()
+    deadline = claim_deadline()
+    blocked: set[str] = set()
+    started: set[str] = set()
+    claimed: list[OutboxEntry] = []
+
+    earlier = OutboxEntry.objects.pending().filter(group_name=OuterRef('group_name'), id__lt=OuterRef('id'))
+    with transaction.atomic():
+        batch = (
+            OutboxEntry.objects.claimable(now).filter(next_attempt_at__lte=now)
+            .exclude(Exists(earlier.filter(Q(next_attempt_at__gt=now) | Q(claimed_until__gt=now))))
+            .annotate(first=~Exists(earlier))
+            .order_by('id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        for entry in batch:
+            # An earlier entry of the group that is not in the batch is being claimed by another worker
+            if entry.group_name in blocked or not (entry.first or entry.group_name in started):
+                blocked.add(entry.group_name)
+                continue
+            started.add(entry.group_name)
+            entry.claimed_until = deadline
+            claimed.append(entry)
+        OutboxEntry.objects.filter(pk__in=[entry.pk for entry in claimed]).update(claimed_until=deadline)
+    return claimed
+
+
+def release(entries: list[OutboxEntry]) -> None:
+    """
+    Give up the claim of entries that were not processed
+    """
+    for entry in entries:
+        OutboxEntry.objects.filter(pk=entry.pk, claimed_until=entry.claimed_until).update(claimed_until=None)
+        entry.claimed_until = None
+
+
+def drain(batch_size: int = 100) -> tuple[int, int]:
+    """
+    Apply up to `batch_size` pending entries. Returns the number of applied and failed entries.
+
+    Entries of a group are applied in order: once an entry fails, the later entries of the same group are released
+    for the next run. Abandoned entries no longer hold their group back, `ldap_reconcile` repairs what they would have
+    changed. The batch is claimed in a short transaction and LDAP is written outside of any, so web requests never
+    wait for the directory on the database lock. A worker that dies leaves its claim to expire after
+    LDAP_OUTBOX_CLAIM_TIMEOUT.
+    """
+    blocked: set[str] = set()
+    applied = failed = 0
+
+    entries = claim(batch_size)
+    unprocessed: list[OutboxEntry] = []
+    for index, entry in enumerate(entries):
+        if entry.group_name in blocked:
+            unprocessed.append(entry)
+            continue
+        try:
+            success = process(entry)
+        except CircuitOpen:
+            unprocessed.extend(entries[index:])
+            break
+        if success:
+            applied += 1
+        else:
+            blocked.add(entry.group_name)
+            failed += 1
+    release(unprocessed)
+
+    return applied, failed
+
+
+def purge(older_than: timedelta) -> int:
+    deleted, _ = OutboxEntry.objects.filter(processed_at__lt=timezone.now() - older_than).delete()
+    return deleted
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, ContextManager, Deque, Iterator, Optional
+
+from django.conf import settings
+from ldap3 import AUTO_BIND_NONE, FIRST, ROUND_ROBIN, SYNC, Connection, ServerPool
+from ldap3.core.exceptions import LDAPBindError, LDAPException, LDAPInvalidCredentialsResult
+from ldap3.core.results import RESULT_INVALID_CREDENTIALS
+
+from .schema import servers
+
+
+class LdapPoolExhausted(LDAPException):
+    pass
+
+
+def bind(conn: Connection) -> None:
+    """
+    Bind `conn` unless it is bound already, raising if that fails
+    """
+    if not conn.bound and not conn.bind():
+        if conn.result.get('result') == RESULT_INVALID_CREDENTIALS:
+            # Not transient: retrying or failing over will not help until the configuration is fixed
+            raise LDAPInvalidCredentialsResult(result=RESULT_INVALID_CREDENTIALS,
+                                               description=conn.result.get('description'),
+                                               dn=settings.LDAP_BIND_DN, message=conn.result.get('message'))
+        raise LDAPBindError(f'Could not bind to LDAP: {conn.result}')
+
+
+class PooledConnection:
+    """
+    A bound connection together with the bookkeeping the pool needs to decide whether it can be reused.
+    """
+
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.broken = False
+
+    @property
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_used
+
+    def close(self) -> None:
+        try:
+            self.connection.unbind()
+        except LDAPException:
+            pass
+
+
+class ConnectionPool:
+    """
+    Per-process pool of bound LDAP connections.
+
+    A thread checks out one connection and keeps it for the duration of the outermost `connection()` block,
+    so nested LDAP work in the same thread (e.g. a signal firing another signal) reuses it instead of
+    binding again. Idle connections are kept bound between checkouts and health checked before reuse.
+    """
+
+    def __init__(self, connect: Callable[[], Connection], max_size: int = 4, max_idle: float = 300,
+                 health_check_interval: float = 30, acquire_timeout: float = 10) -> None:
+        self._connect = connect
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._idle: Deque[PooledConnection] = deque()
+        self._local = threading.local()
+        self.opened = 0
+        self.checkouts = 0
+
+    def _check_fork(self) -> None:
+        # Connections must never be shared with a forked child (e.g. gunicorn workers with --preload)
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _healthy(self, pooled: PooledConnection) -> bool:
+        conn = pooled.connection
+        if pooled.broken or conn.closed or not conn.bound:
+            return False
+        if pooled.idle_for > self.max_idle:
+            return False
+        if pooled.idle_for > self.health_check_interval:
+            try:
+                conn.extend.standard.who_am_i()
+            except LDAPException:
+                return False
+        return True
+
+    def _open(self) -> PooledConnection:
+        conn = self._connect()
+        bind(conn)
+        self.opened += 1
+        return PooledConnection(conn)
+
+    def _checkout(self) -> PooledConnection:
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise LdapPoolExhausted(f'No LDAP connection available after {self.acquire_timeout}s')
+        try:
+            while True:
+                with self._lock:
+                    pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    pooled = self._open()
+                    break
+                if self._healthy(pooled):
+                    break
+                pooled.close()
+        except BaseException:
+            self._slots.release()
+            raise
+        self.checkouts += 1
+        return pooled
+
+    def _checkin(self, pooled: PooledConnection) -> None:
+        pooled.last_used = time.monotonic()
+        if pooled.broken or pooled.connection.closed:
+            pooled.close()
+        else:
+            with self._lock:
+                self._idle.append(pooled)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        """
+        Check out a bound connection for the current thread
+        """
+        self._check_fork()
+        current: Optional[PooledConnection] = getattr(self._local, 'pooled', None)
+        if current is not None:
+            yield current.connection
+            return
+
+        pooled = self._checkout()
+        self._local.pooled = pooled
+        try:
+            yield pooled.connection
+        except LDAPException:
+            pooled.broken = True
+            raise
+        finally:
+            self._local.pooled = None
+            self._checkin(pooled)
+
+    def close(self) -> None:
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            'max_size': self.max_size,
+            'idle': len(self._idle),
+            'opened': self.opened,
+            'checkouts': self.checkouts,
+        }
+
+
+# Searches go round-robin across the read replicas, modifies to the first reachable writable server
+READ = 'read'
+WRITE = 'write'
+
+
+def server_urls(role: str) -> list[str]:
+    write_urls = [settings.LDAP_BIND_URL, *settings.LDAP_WRITE_FAILOVER_URLS]
+    if role == READ and settings.LDAP_READ_URLS:
+        return settings.LDAP_READ_URLS
+    return write_urls
+
+
+def connect(role: str = WRITE, client_strategy: str = SYNC) -> Connection:
+    server_pool = ServerPool(
+        [servers.get(url) for url in server_urls(role)],
+        ROUND_ROBIN if role == READ else FIRST,
+        active=settings.LDAP_SERVER_POOL_CYCLES,
+        exhaust=settings.LDAP_SERVER_EXHAUST_TIME,
+    )
+    return Connection(server_pool, settings.LDAP_BIND_DN, settings.LDAP_BIND_PASSWORD, auto_bind=AUTO_BIND_NONE,
+                      client_strategy=client_strategy, receive_timeout=settings.LDAP_RECEIVE_TIMEOUT)
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(role: str = WRITE) -> ConnectionPool:
+    pool = _pools.get(role)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(role)
+            if pool is None:
+                pool = _pools[role] = ConnectionPool(
+                    partial(connect, role),
+                    max_size=settings.LDAP_POOL_SIZE,
+                    max_idle=settings.LDAP_POOL_MAX_IDLE,
+                    health_check_interval=settings.LDAP_POOL_HEALTH_CHECK_INTERVAL,
+                    acquire_timeout=settings.LDAP_POOL_ACQUIRE_TIMEOUT,
+                )
+    return pool
+
+
+def close_pool() -> None:
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def ldap_connection(role: str = WRITE) -> ContextManager[Connection]:
+    return get_pool(role).connection()
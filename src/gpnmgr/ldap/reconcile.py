@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from gpnmgr.teams.models import Team
+
+from .importers.groups import normalize_dn
+from .models import OutboxEntry
+from .outbox import enqueue
+from .search import Entry
+
+# (normalized DN, DN) pairs, sorted and without duplicates
+SortedDNs = list[tuple[str, str]]
+
+ATTRIBUTES = {
+    'members': settings.LDAP_GROUP_MEMBER_KEY,
+    'admins': settings.LDAP_GROUP_MANAGER_KEY,
+}
+
+
+def sorted_dns(dns: Iterable[Optional[str]]) -> SortedDNs:
+    placeholder = normalize_dn(settings.LDAP_PLACEHOLDER_DN)
+    # The placeholder only keeps groups from becoming empty, whether it is there is no drift
+    return sorted({normalize_dn(dn): dn for dn in dns if dn and normalize_dn(dn) != placeholder}.items())
+
+
+def merge_diff(ours: SortedDNs, theirs: SortedDNs) -> tuple[list[str], list[str]]:
+    """
+    Returns the DNs only in `ours` and only in `theirs`, walking both sorted lists once
+    """
+    only_ours: list[str] = []
+    only_theirs: list[str] = []
+    i = j = 0
+    while i < len(ours) and j < len(theirs):
+        if ours[i][0] == theirs[j][0]:
+            i += 1
+            j += 1
+        elif ours[i][0] < theirs[j][0]:
+            only_ours.append(ours[i][1])
+            i += 1
+        else:
+            only_theirs.append(theirs[j][1])
+            j += 1
+    only_ours.extend(dn for _, dn in ours[i:])
+    only_theirs.extend(dn for _, dn in theirs[j:])
+    return only_ours, only_theirs
+
+
+@dataclass
+class Drift:
+    """
+    The differences of a team and its group: `missing` are in the database but not in LDAP, `extra` the other way
+    round, both per attribute
+    """
+    team: Team
+    missing: dict[str, list[str]] = field(default_factory=dict)
+    extra: dict[str, list[str]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return any(self.missing.values()) or any(self.extra.values())
+
+    def __str__(self) -> str:
+        return ', '.join(
+            f'{attribute} +{len(self.missing.get(attribute, []))}/-{len(self.extra.get(attribute, []))}'
+            for attribute in ATTRIBUTES.values()
+        )
+
+
+@dataclass
+class ReconcileResult:
+    checked: int = 0
+    drifted: int = 0
+    # Teams with outbox entries still waiting to be applied, their drift may be in flight
+    pending: list[str] = field(default_factory=list)
+    # Teams whose group is not in LDAP
+    missing: list[str] = field(default_factory=list)
+    repaired: int = 0
+
+    def __str__(self) -> str:
+        return (f'{self.checked} teams checked, {self.drifted} drifted, {len(self.pending)} with pending changes, '
+                f'{len(self.missing)} without group, {self.repaired} outbox entries queued for repair')
+
+
+class Reconciler:
+    """
+    Compares the memberships of the teams with their LDAP groups.
+
+    Groups are consumed in pages. For each page the memberships of its teams are loaded with one query per
+    attribute, and both sides are compared per group as sorted DN lists with a linear merge, so time grows linearly
+    and memory only with the page size. Each drift is reported and repaired as it is found and then dropped, only
+    counted in the result. Repairs queue the database state in the outbox, in modifies of at most `batch_size` values.
+    """
+
+    def __init__(self, batch_size: int = 500) -> None:
+        self.batch_size = batch_size
+
+    def run(self, pages: Iterable[list[Entry]], repair: bool = False,
+            report: Optional[Callable[[Drift], None]] = None) -> ReconcileResult:
+        result = ReconcileResult()
+        seen: set[str] = set()
+        for page in pages:
+            for drift in self.compare(page, result):
+                result.drifted += 1
+                if report is not None:
+                    report(drift)
+                if repair:
+                    result.repaired += self.repair(drift)
+            seen.update(self.groups(page))
+        result.missing = [
+            ldap_name for ldap_name in Team.objects.exclude(ldap_name=None).values_list('ldap_name', flat=True)
+            if ldap_name not in seen
+        ]
+        return result
+
+    @staticmethod
+    def group_name(attributes: dict) -> Optional[str]:
+        return (attributes.get(settings.LDAP_GROUP_PK) or [None])[0]
+
+    @classmethod
+    def groups(cls, page: list[Entry]) -> dict[str, dict[str, Any]]:
+        """
+        Returns the attributes of the groups of `page` by name, skipping entries without one
+        """
+        groups = {}
+        for _, attributes in page:
+            group_name = cls.group_name(attributes)
+            if group_name:
+                groups[group_name] = attributes
+        return groups
+
+    def compare(self, page: list[Entry], result: ReconcileResult) -> Iterator[Drift]:
+        groups = self.groups(page)
+        teams = {team.ldap_name: team for team in Team.objects.filter(ldap_name__in=groups)}
+        pending = set(OutboxEntry.objects.pending().filter(team__in=teams.values())
+                      .values_list('team__ldap_name', flat=True))
+        ours = {field_name: self.memberships(field_name, teams.values()) for field_name in ATTRIBUTES}
+
+        for group_name, attributes in groups.items():
+            team = teams.get(group_name)
+            if team is None:
+                continue
+            result.checked += 1
+            if group_name in pending:
+                result.pending.append(group_name)
+                continue
+            drift = Drift(team)
+            for field_name, attribute in ATTRIBUTES.items():
+                drift.missing[attribute], drift.extra[attribute] = merge_diff(
+                    ours[field_name].get(team.pk, []), sorted_dns(attributes.get(attribute, [])))
+            if drift:
+                yield drift
+
+    @staticmethod
+    def memberships(field_name: str, teams: Iterable[Team]) -> dict[object, SortedDNs]:
+        dns = defaultdict(list)
+        through = getattr(Team, field_name).through
+        for team_id, dn in through.objects.filter(team__in=teams).values_list('team_id', 'user__object_dn'):
+            dns[team_id].append(dn)
+        return {team_id: sorted_dns(team_dns) for team_id, team_dns in dns.items()}
+
+    def repair(self, drift: Drift) -> int:
+        """
+        Queues the changes that make the group match the team and returns the number of outbox entries.
+
+        Additions come first, so the group does not become empty in between.
+        """
+        changes = [
+            (attribute, 'add', dn) for attribute, dns in drift.missing.items() for dn in dns
+        ] + [
+            (attribute, 'delete', dn) for attribute, dns in drift.extra.items() for dn in dns
+        ]
+        member_key = settings.LDAP_GROUP_MEMBER_KEY
+        if (settings.LDAP_GROUP_MEMBER_REQUIRED and drift.extra.get(member_key)
+                and not drift.team.members.filter(is_placeholder=False).exists()):
+            # The group keeps the placeholder, like after removing the last member in gpnmgr
+            changes.insert(0, (member_key, 'add', settings.LDAP_PLACEHOLDER_DN))
+
+        entries = 0
+        for start in range(0, len(changes), self.batch_size):
+            # Each transaction results in one outbox entry, so one modify
+            with transaction.atomic():
+                for attribute, operation, dn in changes[start:start + self.batch_size]:
+                    enqueue(drift.team, attribute, **{operation: [dn]})
+            entries += 1
+        return entries
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+from django.conf import settings
+from ldap3 import Connection
+from ldap3.core.exceptions import (LDAPBindError, LDAPCommunicationError, LDAPException, LDAPResponseTimeoutError,
+                                   LDAPServerPoolExhaustedError)
+
+from .pool import READ, WRITE, LdapPoolExhausted, ldap_connection
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Errors caused by the directory being slow or unreachable, as opposed to errors of the operation itself. Binds
+# failing with invalidCredentials raise LDAPInvalidCredentialsResult instead of LDAPBindError, see pool.bind()
+TRANSIENT_ERRORS = (LDAPCommunicationError, LDAPResponseTimeoutError, LDAPBindError, LDAPServerPoolExhaustedError,
+                    LdapPoolExhausted)
+
+
+class CircuitOpen(LDAPException):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling the directory after `failure_threshold` consecutive transient failures.
+
+    While open every call fails immediately with CircuitOpen. After `reset_timeout` seconds a single trial call is let
+    through (half open); its success closes the breaker again, its failure opens it for another period.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpen('LDAP circuit breaker is open')
+                self.state = self.HALF_OPEN
+            elif self.state == self.HALF_OPEN:
+                # Only the trial call may pass
+                raise CircuitOpen('LDAP circuit breaker is half open')
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    logger.warning('LDAP circuit breaker opened after %d failures', self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    @property
+    def stats(self) -> dict[str, object]:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+        }
+
+
+# Replicas and the writable servers fail independently
+breakers = {
+    role: CircuitBreaker(settings.LDAP_BREAKER_FAILURE_THRESHOLD, settings.LDAP_BREAKER_RESET_TIMEOUT)
+    for role in (READ, WRITE)
+}
+
+
+def backoff(attempt: int) -> float:
+    delay = min(settings.LDAP_RETRY_DELAY * 2 ** attempt, settings.LDAP_RETRY_MAX_DELAY)
+    return random.uniform(delay / 2, delay)
+
+
+def call(operation: Callable[[Connection], T], role: str = WRITE, retries: Optional[int] = None) -> T:
+    """
+    Run `operation` with a pooled connection of `role`, retrying transient failures with jittered backoff
+    """
+    if retries is None:
+        retries = settings.LDAP_RETRIES
+    breaker = breakers[role]
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            with ldap_connection(role) as conn:
+                result = operation(conn)
+        except TRANSIENT_ERRORS as e:
+            breaker.record_failure()
+            if attempt >= retries or breaker.state == breaker.OPEN:
+                raise
+            logger.info('Retrying LDAP operation after %s', e)
+            time.sleep(backoff(attempt))
+            attempt += 1
+        except Exception:
+            # The directory answered, so it is healthy
+            breaker.record_success()
+            raise
+        else:
+            breaker.record_success()
+            return result
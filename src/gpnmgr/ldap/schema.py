@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from ldap3 import ALL, NONE, Connection, Server
+from ldap3.core.exceptions import LDAPDefinitionError, LDAPException
+
+logger = logging.getLogger(__name__)
+
+
+def schema_files(url: str) -> tuple[Path, Path]:
+    directory = Path(settings.LDAP_SCHEMA_CACHE_DIR) / re.sub(r'[^A-Za-z0-9.-]+', '_', url)
+    return directory / 'dsa_info.json', directory / 'schema.json'
+
+
+def refresh_schema(url: str) -> Server:
+    """
+    Read the root DSE and schema from the directory and store them in LDAP_SCHEMA_CACHE_DIR
+    """
+    server = Server(url, get_info=ALL, connect_timeout=settings.LDAP_CONNECT_TIMEOUT)
+    conn = Connection(server, settings.LDAP_BIND_DN, settings.LDAP_BIND_PASSWORD,
+                      receive_timeout=settings.LDAP_RECEIVE_TIMEOUT)
+    try:
+        if not conn.bind():
+            raise LDAPException(f'Could not bind to LDAP: {conn.result}')
+        info_file, schema_file = schema_files(url)
+        info_file.parent.mkdir(parents=True, exist_ok=True)
+        # Write to temporary files first so other processes never load a partial file
+        for info, target in ((server.info, info_file), (server.schema, schema_file)):
+            temporary = target.with_suffix('.tmp')
+            info.to_file(str(temporary))
+            temporary.replace(target)
+    finally:
+        conn.unbind()
+    server.get_info = NONE
+    return server
+
+
+def schema_version(url: str) -> float:
+    """
+    Modification time of the older of the cached schema files of `url`, 0 if one is missing
+    """
+    try:
+        return min(path.stat().st_mtime for path in schema_files(url))
+    except FileNotFoundError:
+        return 0
+
+
+def is_stale(version: float) -> bool:
+    return time.time() - version > settings.LDAP_SCHEMA_MAX_AGE
+
+
+def load_server(url: str, allow_stale: bool = False) -> Optional[Server]:
+    """
+    Build a server from the cached schema files. Returns None if they are missing, corrupt or, unless `allow_stale`,
+    older than LDAP_SCHEMA_MAX_AGE.
+    """
+    version = schema_version(url)
+    if not version or (is_stale(version) and not allow_stale):
+        return None
+    info_file, schema_file = schema_files(url)
+    try:
+        server = Server.from_definition(url, str(info_file), str(schema_file))
+    except (LDAPDefinitionError, ValueError, OSError) as e:
+        logger.warning('Ignoring the cached LDAP schema of %s: %s', url, e)
+        return None
+    server.connect_timeout = settings.LDAP_CONNECT_TIMEOUT
+    # from_definition asks for ALL, which would read everything again on bind
+    server.get_info = NONE
+    return server
+
+
+class ServerCache:
+    """
+    Per-process server definitions, rebuilt when the cached schema files change on disk.
+
+    Stale files are still used while a background thread refreshes them. Only without any usable files the schema is
+    read before connecting, and after a failure not again for LDAP_SCHEMA_RETRY_DELAY seconds.
+    """
+
+    def __init__(self) -> None:
+        self._servers: dict[str, tuple[Server, float]] = {}
+        self._failures: dict[str, float] = {}
+        self._refreshing: dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    def _backing_off(self, url: str) -> bool:
+        failed_at = self._failures.get(url)
+        return failed_at is not None and time.monotonic() - failed_at < settings.LDAP_SCHEMA_RETRY_DELAY
+
+    def _refresh(self, url: str) -> Optional[Server]:
+        try:
+            server = refresh_schema(url)
+        except (LDAPException, OSError) as e:
+            logger.warning('Could not cache the LDAP schema of %s: %s', url, e)
+            self._failures[url] = time.monotonic()
+            return None
+        self._failures.pop(url, None)
+        return server
+
+    def _refresh_in_background(self, url: str) -> None:
+        thread = self._refreshing.get(url)
+        if (thread is not None and thread.is_alive()) or self._backing_off(url):
+            return
+        thread = self._refreshing[url] = threading.Thread(target=self._refresh, args=(url, ), daemon=True,
+                                                           name=f'ldap-schema-{url}')
+        thread.start()
+
+    def get(self, url: str) -> Server:
+        version = schema_version(url)
+        with self._lock:
+            cached = self._servers.get(url)
+            server = cached[0] if cached is not None and cached[1] == version else None
+            if server is None and version:
+                server = load_server(url, allow_stale=True)
+            if server is not None:
+                if is_stale(version):
+                    self._refresh_in_background(url)
+                self._servers[url] = (server, version)
+                return server
+
+            server = None if self._backing_off(url) else self._refresh(url)
+            if server is None:
+                return Server(url, get_info=NONE, connect_timeout=settings.LDAP_CONNECT_TIMEOUT)
+            self._servers[url] = (server, schema_version(url))
+            return server
+
+
+servers = ServerCache()
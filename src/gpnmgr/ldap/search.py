@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import queue
+import re
+import threading
+from contextlib import ExitStack
+from functools import partial
+from typing import Any, Iterable, Iterator, Optional, TypeVar
+
+from django.conf import settings
+from ldap3 import BASE, SUBTREE, Connection
+from ldap3.core.exceptions import LDAPOperationResult
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.utils.ciDict import CaseInsensitiveDict
+
+from . import resilience
+from .pool import READ, ldap_connection
+from .resilience import TRANSIENT_ERRORS, breakers
+
+T = TypeVar('T')
+
+PAGED_RESULTS_CONTROL = '1.2.840.113556.1.4.319'
+RANGE_OPTION = re.compile(r'(?:^|;)range=(\d+)-(\d+|\*)', re.IGNORECASE)
+
+# (dn, attributes), the values are lists or RangedValues
+Entry = tuple[str, dict[str, Any]]
+
+
+def paged_search(search_base: str, search_filter: str, attributes: list[str], page_size: Optional[int] = None,
+                 role: str = READ) -> Iterator[list[Entry]]:
+    """
+    Yields the results of a subtree search page by page, using the simple paged results control.
+
+    Entries are taken from the raw response instead of conn.entries, so no ldap3 Entry objects are built and only one
+    page is held at a time. The connection stays checked out until the generator is exhausted or closed, because the
+    paging cookie is bound to it. The consumer may use that connection between pages, e.g. through the per-thread
+    checkout of the pool. A page with any result but success raises, see check_result().
+    """
+    if page_size is None:
+        page_size = settings.LDAP_SEARCH_PAGE_SIZE
+    breaker = breakers[role]
+    # Checked before the checkout, so an open breaker does not bind or wait for a pooled connection
+    breaker.before_call()
+    with ExitStack() as stack:
+        try:
+            conn = stack.enter_context(ldap_connection(role))
+        except TRANSIENT_ERRORS:
+            breaker.record_failure()
+            raise
+        except Exception:
+            # The directory answered, e.g. with invalidCredentials
+            breaker.record_success()
+            raise
+        cookie = None
+        while True:
+            try:
+                conn.search(
+                    search_base=search_base,
+                    search_filter=search_filter,
+                    search_scope=SUBTREE,
+                    attributes=attributes,
+                    paged_size=page_size,
+                    paged_cookie=cookie,
+                )
+            except TRANSIENT_ERRORS:
+                breaker.record_failure()
+                raise
+            except Exception:
+                breaker.record_success()
+                raise
+            breaker.record_success()
+            check_result(conn, search_base)
+
+            # Read before yielding: the consumer may use the same connection, which replaces its result and response
+            cookie = conn.result.get('controls', {}).get(PAGED_RESULTS_CONTROL, {}).get('value', {}).get('cookie')
+            yield [
+                (response['dn'], normalize_attributes(response['dn'], response['attributes']))
+                for response in conn.response if response['type'] == 'searchResEntry'
+            ]
+
+            if not cookie:
+                return
+            breaker.before_call()
+
+
+def check_result(conn: Connection, dn: str) -> None:
+    """
+    Raises the LDAPOperationResult subclass matching an unsuccessful result.
+
+    conn.search() also returns False for an empty result, so only the result code tells a failed search apart. That
+    includes sizeLimitExceeded, whose entries are a truncated result that must not pass for the complete one.
+    """
+    result = conn.result
+    if result.get('result') != RESULT_SUCCESS:
+        raise LDAPOperationResult(result=result.get('result'), description=result.get('description'), dn=dn,
+                                  message=result.get('message'), response_type=result.get('type'))
+
+
+def normalize_attributes(dn: str, attributes: dict) -> dict[str, Any]:
+    """
+    Returns the attributes of a search result entry with every value wrapped in a list.
+
+    Attributes the server returned only partially (`member;range=0-1499`) become RangedValues under their plain name.
+    """
+    normalized = CaseInsensitiveDict()
+    for attribute, value in attributes.items():
+        name, _, options = attribute.partition(';')
+        start, end = parse_range(options)
+        if start is None:
+            normalized[attribute] = value if isinstance(value, list) else [value]
+        elif end is None:
+            # The last range, or all values at once
+            normalized[name] = value if isinstance(value, list) else [value]
+        else:
+            normalized[name] = RangedValues(dn, name, value, end)
+    return normalized
+
+
+def parse_range(options: str) -> tuple[Optional[int], Optional[int]]:
+    """
+    Returns (start, end) of the range option of an attribute description, end is None for the last range
+    """
+    match = RANGE_OPTION.search(options)
+    if match is None:
+        return None, None
+    start, end = match.groups()
+    return int(start), None if end == '*' else int(end)
+
+
+def fetch_range(conn: Connection, dn: str, attribute: str, start: int) -> tuple[list, Optional[int]]:
+    conn.search(search_base=dn, search_filter='(objectClass=*)', search_scope=BASE,
+                attributes=[f'{attribute};range={start}-*'])
+    for response in conn.response:
+        if response['type'] != 'searchResEntry':
+            continue
+        for description, values in response['attributes'].items():
+            name, _, options = description.partition(';')
+            if name.lower() == attribute.lower():
+                return values if isinstance(values, list) else [values], parse_range(options)[1]
+    return [], None
+
+
+class RangedValues:
+    """
+    The values of an attribute that the server returns in ranges, like Active Directory does for large groups.
+
+    Iterating yields the values of the first range, then fetches and yields the following ranges one at a time, each
+    with a retried base search. So huge member lists are neither truncated nor held in memory at once.
+    """
+
+    def __init__(self, dn: str, attribute: str, values: list, end: int) -> None:
+        self.dn = dn
+        self.attribute = attribute
+        self.values = values
+        self.end = end
+
+    def __iter__(self) -> Iterator:
+        yield from self.values
+        end: Optional[int] = self.end
+        while end is not None:
+            values, end = resilience.call(partial(fetch_range, dn=self.dn, attribute=self.attribute, start=end + 1),
+                                          role=READ)
+            yield from values
+
+    def __repr__(self) -> str:
+        return f'<RangedValues {self.attribute} of {self.dn}>'
+
+
+def prefetch(items: Iterable[T], depth: int = 1) -> Iterator[T]:
+    """
+    Iterates `items` in a worker thread, staying up to `depth` items ahead of the consumer.
+
+    Used to fetch the next LDAP page while the current one is written to the database.
+    """
+    buffer: queue.Queue[tuple[Any, Optional[BaseException]]] = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item: tuple[Any, Optional[BaseException]]) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def work() -> None:
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((done, e))
+        else:
+            put((done, None))
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+    worker = threading.Thread(target=work, name='ldap-prefetch', daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        worker.join()
+
+
+def entries(pages: Iterable[list[Entry]]) -> Iterator[Entry]:
+    for page in pages:
+        yield from page
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+_state = threading.local()
+
+
+@contextmanager
+def suspend_sync() -> Iterator[None]:
+    """
+    Don't queue team changes made by the current thread for LDAP, e.g. while importing what was just read from there.
+
+    Blocks can be nested. Only the LDAP sync is suspended, the signal handlers and audit logging still run.
+    """
+    depth = getattr(_state, 'depth', 0)
+    _state.depth = depth + 1
+    try:
+        yield
+    finally:
+        _state.depth = depth
+
+
+def sync_suspended() -> bool:
+    return getattr(_state, 'depth', 0) > 0
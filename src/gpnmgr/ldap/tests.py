@@ -0,0 +1,1036 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from ldap3 import BASE, MODIFY_ADD, Connection, MOCK_SYNC, NONE, OFFLINE_SLAPD_2_4, Server
+from ldap3.core.exceptions import (LDAPException, LDAPInvalidCredentialsResult, LDAPNoSuchObjectResult,
+                                   LDAPSizeLimitExceededResult, LDAPSocketReceiveError)
+
+from gpnmgr.accounts.models import User
+from gpnmgr.ldap import outbox, resilience, search, suspend_sync, sync_suspended
+from gpnmgr.ldap.cache import GroupDNCache, group_dn_cache, resolve_group_dn
+from gpnmgr.ldap.importers import GroupImporter, Plan, PlanError, UserImporter
+from gpnmgr.ldap.ldif import LdifError, read_ldif, search_ldif
+from gpnmgr.ldap.models import OutboxEntry, SyncWatermark
+from gpnmgr.ldap.reconcile import Reconciler, merge_diff, sorted_dns
+from gpnmgr.ldap.pool import READ, WRITE, ConnectionPool, LdapPoolExhausted, server_urls
+from gpnmgr.ldap.resilience import CircuitBreaker, CircuitOpen
+from gpnmgr.ldap.schema import ServerCache, load_server, schema_files
+from gpnmgr.ldap.search import paged_search, prefetch
+from gpnmgr.ldap.watch import ADD, DELETE, MODIFY, MODIFY_DN, Change, DirectoryWatcher
+from gpnmgr.teams.models import Team
+
+BIND_DN = 'cn=admin,dc=example,dc=com'
+
+
+GROUP_DN = 'cn=kueche,ou=groups,dc=example,dc=com'
+
+
+def mock_connection() -> Connection:
+    conn = Connection(Server('mock', get_info=OFFLINE_SLAPD_2_4), BIND_DN, 'secret', client_strategy=MOCK_SYNC)
+    conn.strategy.add_entry(BIND_DN, {'userPassword': 'secret', 'sn': 'admin'})
+    conn.strategy.add_entry(GROUP_DN, {'objectClass': 'groupOfNames', 'cn': 'kueche'})
+    return conn
+
+
+def user_dn(username: str) -> str:
+    return f'uid={username},ou=users,dc=example,dc=com'
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(mock_connection, max_size=2, acquire_timeout=0.1)
+
+    def testConnectionIsReused(self):
+        with self.pool.connection() as first:
+            self.assertTrue(first.bound)
+        with self.pool.connection() as second:
+            self.assertIs(first, second)
+        self.assertEqual(self.pool.opened, 1)
+
+    def testNestedCheckoutSharesConnection(self):
+        with self.pool.connection() as outer:
+            with self.pool.connection() as inner:
+                self.assertIs(outer, inner)
+        self.assertEqual(self.pool.checkouts, 1)
+
+    def testThreadsGetOwnConnection(self):
+        seen = []
+
+        def work():
+            with self.pool.connection() as conn:
+                seen.append(conn)
+
+        with self.pool.connection() as conn:
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+            self.assertIsNot(seen[0], conn)
+
+    def testPoolExhausted(self):
+        pool = ConnectionPool(mock_connection, max_size=1, acquire_timeout=0.1)
+        errors = []
+
+        def work():
+            try:
+                with pool.connection():
+                    pass
+            except LdapPoolExhausted as e:
+                errors.append(e)
+
+        with pool.connection():
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(errors), 1)
+
+    def testBrokenConnectionIsDiscarded(self):
+        with self.assertRaises(LDAPException):
+            with self.pool.connection() as conn:
+                raise LDAPException('connection reset')
+        with self.pool.connection() as fresh:
+            self.assertIsNot(conn, fresh)
+        self.assertEqual(self.pool.opened, 2)
+
+
+class GroupDNCacheTest(SimpleTestCase):
+    def setUp(self):
+        group_dn_cache.clear()
+        self.conn = mock_connection()
+        self.conn.bind()
+
+    def testResolveCachesDN(self):
+        self.assertEqual(resolve_group_dn(self.conn, 'kueche'), GROUP_DN)
+        self.conn.strategy.remove_entry(GROUP_DN)
+        self.assertEqual(resolve_group_dn(self.conn, 'kueche'), GROUP_DN)
+        group_dn_cache.invalidate('kueche')
+        with self.assertRaises(IntegrityError):
+            resolve_group_dn(self.conn, 'kueche')
+
+    def testLocalEntriesExpire(self):
+        cache = GroupDNCache(ttl=0)
+        cache.set('kueche', GROUP_DN)
+        self.assertIsNone(cache.get('kueche'))
+
+    def testClearDropsSharedEntries(self):
+        cache = GroupDNCache(ttl=60, shared_cache='default')
+        cache.set('kueche', GROUP_DN)
+        self.assertEqual(GroupDNCache(ttl=60, shared_cache='default').get('kueche'), GROUP_DN)
+        cache.clear()
+        self.assertIsNone(GroupDNCache(ttl=60, shared_cache='default').get('kueche'))
+
+
+@override_settings(LDAP_RETRY_DELAY=0)
+class ResilienceTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(mock_connection)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        for patcher in (mock.patch('gpnmgr.ldap.resilience.ldap_connection', lambda role: self.pool.connection()),
+                        mock.patch.dict('gpnmgr.ldap.resilience.breakers', {WRITE: self.breaker})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def testTransientFailuresAreRetried(self):
+        operation = mock.Mock(side_effect=[LDAPSocketReceiveError('timeout'), 'result'])
+        self.assertEqual(resilience.call(operation, retries=2), 'result')
+        self.assertEqual(operation.call_count, 2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.pool.opened, 2)
+
+    def testBreakerOpensAndFailsFast(self):
+        operation = mock.Mock(side_effect=LDAPSocketReceiveError('timeout'))
+        with self.assertRaises(LDAPSocketReceiveError):
+            resilience.call(operation, retries=5)
+        self.assertEqual(operation.call_count, 3)
+        self.assertEqual(self.breaker.stats, {'state': CircuitBreaker.OPEN, 'failures': 3, 'trips': 1})
+
+        with self.assertRaises(CircuitOpen):
+            resilience.call(operation)
+        self.assertEqual(operation.call_count, 3)
+
+    def testHalfOpenTrialClosesBreaker(self):
+        self.breaker.reset_timeout = 0
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertEqual(resilience.call(lambda conn: 'result'), 'result')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+    def testInvalidCredentialsAreNotRetried(self):
+        pool = ConnectionPool(lambda: Connection(Server('mock', get_info=OFFLINE_SLAPD_2_4), BIND_DN, 'wrong',
+                                                 client_strategy=MOCK_SYNC))
+        operation = mock.Mock()
+        with mock.patch('gpnmgr.ldap.resilience.ldap_connection', lambda role: pool.connection()):
+            with self.assertRaises(LDAPInvalidCredentialsResult):
+                resilience.call(operation, retries=2)
+        operation.assert_not_called()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+class ServerUrlTest(SimpleTestCase):
+    @override_settings(LDAP_BIND_URL='ldap://primary', LDAP_WRITE_FAILOVER_URLS=['ldap://secondary'], LDAP_READ_URLS=[])
+    def testReadsUseWritableServersWithoutReplicas(self):
+        self.assertEqual(server_urls(READ), ['ldap://primary', 'ldap://secondary'])
+
+    @override_settings(LDAP_BIND_URL='ldap://primary', LDAP_READ_URLS=['ldap://replica1', 'ldap://replica2'])
+    def testReadWriteSplit(self):
+        self.assertEqual(server_urls(READ), ['ldap://replica1', 'ldap://replica2'])
+        self.assertEqual(server_urls(WRITE), ['ldap://primary'])
+
+
+class SchemaCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(LDAP_SCHEMA_CACHE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write_schema(self, mtime: float, url: str = 'ldap://localhost') -> None:
+        offline = Server('mock', get_info=OFFLINE_SLAPD_2_4)
+        offline.get_info_from_server(None)
+        for info, path in zip((offline.info, offline.schema), schema_files(url)):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            info.to_file(str(path))
+            os.utime(path, (mtime, mtime))
+
+    def testMissingSchemaIsNotLoaded(self):
+        self.assertIsNone(load_server('ldap://localhost'))
+
+    def testLoadServerFromFiles(self):
+        self.write_schema(time.time())
+        server = load_server('ldap://localhost')
+        self.assertEqual(server.get_info, NONE)
+        self.assertIn('inetOrgPerson', server.schema.object_classes)
+        self.assertIsNone(load_server('ldap://replica'))
+
+    @override_settings(LDAP_SCHEMA_MAX_AGE=60)
+    def testStaleSchemaIsNotLoaded(self):
+        self.write_schema(time.time() - 120)
+        self.assertIsNone(load_server('ldap://localhost'))
+        self.assertIsNotNone(load_server('ldap://localhost', allow_stale=True))
+
+    def testCorruptSchemaIsNotLoaded(self):
+        self.write_schema(time.time())
+        schema_files('ldap://localhost')[1].write_text('{"type": "SchemaInfo"')
+        self.assertIsNone(load_server('ldap://localhost'))
+
+    def testServerIsReusedUntilFilesChange(self):
+        servers = ServerCache()
+        self.write_schema(time.time() - 10)
+        first = servers.get('ldap://localhost')
+        self.assertIs(servers.get('ldap://localhost'), first)
+        self.write_schema(time.time())
+        self.assertIsNot(servers.get('ldap://localhost'), first)
+
+    @override_settings(LDAP_SCHEMA_MAX_AGE=60)
+    def testStaleSchemaIsUsedWhileRefreshed(self):
+        servers = ServerCache()
+        self.write_schema(time.time() - 120)
+        with mock.patch('gpnmgr.ldap.schema.refresh_schema') as refresh:
+            server = servers.get('ldap://localhost')
+            servers._refreshing['ldap://localhost'].join()
+        self.assertIn('inetOrgPerson', server.schema.object_classes)
+        refresh.assert_called_once_with('ldap://localhost')
+
+    def testFailedRefreshIsNotRetriedImmediately(self):
+        servers = ServerCache()
+        with mock.patch('gpnmgr.ldap.schema.refresh_schema', side_effect=LDAPException('down')) as refresh:
+            self.assertIsNone(servers.get('ldap://localhost').schema)
+            self.assertIsNone(servers.get('ldap://localhost').schema)
+        refresh.assert_called_once_with('ldap://localhost')
+
+
+class PagedSearchTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(mock_connection, max_size=1, acquire_timeout=0.1)
+        with self.pool.connection() as conn:
+            for i in range(5):
+                conn.strategy.add_entry(user_dn(f'user{i}'), {'objectClass': 'inetOrgPerson', 'uid': f'user{i}',
+                                                              'sn': f'User {i}'})
+        patcher = mock.patch('gpnmgr.ldap.search.ldap_connection', lambda role: self.pool.connection())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self):
+        return paged_search('ou=users,dc=example,dc=com', '(objectClass=inetOrgPerson)', ['uid', 'sn'], page_size=2)
+
+    def testSearchIsPaged(self):
+        pages = list(self.search())
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        found = {dn: attributes['uid'] for dn, attributes in search.entries(pages)}
+        self.assertEqual(found, {user_dn(f'user{i}'): [f'user{i}'] for i in range(5)})
+
+    def testConnectionIsUsableBetweenPages(self):
+        found = []
+        for page in self.search():
+            found.extend(dn for dn, attributes in page)
+            # The nested checkout gets the connection of the search, this replaces its result
+            with self.pool.connection() as conn:
+                conn.search(GROUP_DN, '(objectClass=*)', search_scope=BASE, attributes=['cn'])
+        self.assertEqual(sorted(found), [user_dn(f'user{i}') for i in range(5)])
+
+    def testMissingBaseRaises(self):
+        with self.assertRaises(LDAPNoSuchObjectResult):
+            list(paged_search('ou=missing,dc=example,dc=com', '(objectClass=*)', ['uid']))
+
+    def testSizeLimitRaises(self):
+        original = Connection.search
+
+        def search(conn, *args, **kwargs):
+            original(conn, *args, **kwargs)
+            conn.result = {**conn.result, 'result': 4, 'description': 'sizeLimitExceeded'}
+            return True
+
+        with mock.patch.object(Connection, 'search', search):
+            pages = self.search()
+            with self.assertRaises(LDAPSizeLimitExceededResult):
+                next(pages)
+
+    def testOpenBreakerFailsBeforeCheckout(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        with mock.patch.dict('gpnmgr.ldap.search.breakers', {READ: breaker}):
+            with self.assertRaises(CircuitOpen):
+                next(self.search())
+        self.assertEqual(self.pool.checkouts, 1)
+
+    def testPrefetchReleasesConnection(self):
+        for page in prefetch(self.search()):
+            break
+        # The pool only holds one connection, so this fails if the search still has it checked out
+        with self.pool.connection():
+            pass
+
+    def testPrefetchRaisesErrors(self):
+        def pages():
+            yield 1
+            raise LDAPException('broken')
+
+        consumed = []
+        with self.assertRaises(LDAPException):
+            for page in prefetch(pages()):
+                consumed.append(page)
+        self.assertEqual(consumed, [1])
+
+
+class RangedValuesTest(SimpleTestCase):
+    def testRangesAreFetched(self):
+        members = [user_dn(f'user{i}') for i in range(7)]
+        requested = []
+
+        def base_search(search_base, search_filter, search_scope, attributes):
+            start = int(attributes[0].partition('range=')[2].partition('-')[0])
+            end = min(start + 2, len(members) - 1)
+            requested.append(attributes[0])
+            conn.response = [{'type': 'searchResEntry', 'dn': search_base, 'attributes': {
+                f'member;range={start}-{"*" if end == len(members) - 1 else end}': members[start:end + 1],
+            }}]
+
+        conn = mock.Mock()
+        conn.search.side_effect = base_search
+        attributes = search.normalize_attributes(GROUP_DN, {'cn': 'kueche', 'Member;Range=0-2': members[:3]})
+        self.assertEqual(attributes['cn'], ['kueche'])
+        with mock.patch('gpnmgr.ldap.search.resilience.call', lambda operation, role: operation(conn)):
+            self.assertEqual(list(attributes['member']), members)
+        self.assertEqual(requested, ['Member;range=3-*', 'Member;range=6-*'])
+
+        # The whole attribute in the last range
+        attributes = search.normalize_attributes(GROUP_DN, {'member;range=0-*': members})
+        self.assertEqual(attributes['member'], members)
+
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        group_dn_cache.clear()
+        self.pool = ConnectionPool(mock_connection)
+        patcher = mock.patch('gpnmgr.ldap.resilience.ldap_connection', lambda role: self.pool.connection())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        self.alice = User.objects.create(username='alice', object_dn=user_dn('alice'))
+        self.bob = User.objects.create(username='bob', object_dn=user_dn('bob'))
+        User.objects.create(username='null', object_dn=settings.LDAP_PLACEHOLDER_DN, is_placeholder=True)
+
+    def group_members(self) -> list[str]:
+        with self.pool.connection() as conn:
+            conn.search(GROUP_DN, '(objectClass=*)', attributes=['member', 'owner'])
+            return sorted(conn.entries[0].entry_attributes_as_dict.get('member', []))
+
+    def testMembershipChangeIsQueued(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice, self.bob)
+        self.assertEqual(self.team.ldap_sync_status.pending, 1)
+        self.assertEqual(self.group_members(), [])
+
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(self.group_members(), [user_dn('alice'), user_dn('bob')])
+        self.assertTrue(self.team.ldap_sync_status.in_sync)
+
+    def testChangesOfTransactionAreCoalesced(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice, self.bob)
+            self.team.admins.add(self.alice)
+            self.team.admins.remove(self.alice)
+            self.team.members.remove(self.alice)
+
+        entry = OutboxEntry.objects.get()
+        self.assertEqual(entry.changes, {
+            settings.LDAP_GROUP_MEMBER_KEY: {'add': [user_dn('bob')], 'delete': []},
+            settings.LDAP_GROUP_MANAGER_KEY: {'add': [], 'delete': []},
+        })
+
+    def testUsersWithoutDNAreSkipped(self):
+        carol = User.objects.create(username='carol')
+        with self.assertLogs('gpnmgr.teams.signals.team', 'WARNING'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.team.members.add(self.alice, carol)
+
+        entry = OutboxEntry.objects.get()
+        self.assertEqual(entry.changes[settings.LDAP_GROUP_MEMBER_KEY]['add'], [user_dn('alice')])
+
+    def testRolledBackChangesAreDropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.team.members.add(self.alice)
+                    raise IntegrityError()
+            except IntegrityError:
+                pass
+            self.team.members.add(self.bob)
+
+        entry = OutboxEntry.objects.get()
+        self.assertEqual(entry.changes[settings.LDAP_GROUP_MEMBER_KEY]['add'], [user_dn('bob')])
+
+    @override_settings(LDAP_SYNC_ON_COMMIT=True)
+    def testSyncOnCommit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        self.assertEqual(self.group_members(), [user_dn('alice')])
+        self.assertTrue(self.team.ldap_sync_status.in_sync)
+
+    def testFailedEntryBlocksLaterEntriesOfGroup(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.remove(self.alice)
+        with mock.patch('gpnmgr.ldap.outbox.apply', side_effect=outbox.OutboxError('down')):
+            self.assertEqual(outbox.drain(), (0, 1))
+        self.assertEqual([entry.attempts for entry in OutboxEntry.objects.all()], [1, 0])
+        self.assertEqual(self.team.ldap_sync_status.failing, 1)
+
+    def testEntriesNotDueDoNotFillBatch(self):
+        other = Team.objects.create(name='Bar', slug='bar', ldap_name='bar')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.members.add(self.alice)
+        OutboxEntry.objects.filter(team=self.team).update(next_attempt_at=timezone.now() + timedelta(minutes=5))
+
+        with mock.patch('gpnmgr.ldap.outbox.apply') as apply:
+            self.assertEqual(outbox.drain(batch_size=1), (1, 0))
+        self.assertEqual([call.args[0].team for call in apply.call_args_list], [other])
+
+    @override_settings(LDAP_OUTBOX_MAX_ATTEMPTS=2)
+    def testEntryIsAbandonedAfterMaxAttempts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.bob)
+        first = OutboxEntry.objects.first()
+
+        for _ in range(2):
+            with mock.patch('gpnmgr.ldap.outbox.apply', side_effect=outbox.OutboxError('down')):
+                self.assertEqual(outbox.drain(), (0, 1))
+            OutboxEntry.objects.filter(pk=first.pk).update(next_attempt_at=timezone.now())
+        first.refresh_from_db()
+        self.assertIsNotNone(first.abandoned_at)
+        sync_status = self.team.ldap_sync_status
+        self.assertEqual((sync_status.pending, sync_status.abandoned), (1, 1))
+        self.assertFalse(sync_status.in_sync)
+
+        # The abandoned entry no longer holds back the group
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(self.group_members(), [user_dn('bob')])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('ldap_sync_outbox', '--retry-abandoned')
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(self.group_members(), [user_dn('alice'), user_dn('bob')])
+        self.assertTrue(self.team.ldap_sync_status.in_sync)
+
+    def testServerWithoutPermissiveModify(self):
+        with self.pool.connection() as conn:
+            conn.modify(GROUP_DN, {'member': [(MODIFY_ADD, [user_dn('alice')])]})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice, self.bob)
+
+        original = Connection.modify
+
+        def modify(conn, dn, changes, controls=None):
+            if controls:
+                # The control is ignored and the whole modify rejected for the value that exists
+                conn.result = {'result': 20, 'description': 'attributeOrValueExists', 'message': ''}
+                return False
+            return original(conn, dn, changes)
+
+        with mock.patch.object(Connection, 'modify', modify):
+            self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(self.group_members(), [user_dn('alice'), user_dn('bob')])
+
+    def testEmptyGroupGetsPlaceholderInSameModify(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.remove(self.alice)
+
+        self.assertEqual(list(self.team.members.values_list('username', flat=True)), ['null'])
+        self.assertEqual(self.team.member_count, 0)
+        entry = OutboxEntry.objects.last()
+        self.assertEqual(entry.changes[settings.LDAP_GROUP_MEMBER_KEY], {
+            'add': [settings.LDAP_PLACEHOLDER_DN],
+            'delete': [user_dn('alice')],
+        })
+        self.assertEqual(OutboxEntry.objects.count(), 2)
+        # Added, removed alice, added the placeholder
+        operations = [entry.changes['members']['operation'] for entry in
+                      LogEntry.objects.get_for_object(self.team).filter(changes__has_key='members').order_by('pk')]
+        self.assertEqual(operations, ['add', 'delete', 'add'])
+
+    def testMissingPlaceholderIsLogged(self):
+        User.objects.filter(is_placeholder=True).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        with self.assertLogs('gpnmgr.accounts.models.user', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.team.members.remove(self.alice)
+
+        self.assertFalse(self.team.members.exists())
+        self.assertEqual(OutboxEntry.objects.last().changes[settings.LDAP_GROUP_MEMBER_KEY], {
+            'add': [],
+            'delete': [user_dn('alice')],
+        })
+
+    def testLdapIsWrittenOutsideTransaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        # The test case itself runs inside a transaction, any further one would add a savepoint
+        depth = len(transaction.get_connection().savepoint_ids)
+        depths = []
+
+        with mock.patch('gpnmgr.ldap.outbox.apply',
+                        side_effect=lambda entry: depths.append(len(transaction.get_connection().savepoint_ids))):
+            self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(depths, [depth])
+
+    def testClaimedEntriesAreSkipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.bob)
+
+        claimed = outbox.claim(batch_size=1)
+        self.assertEqual(len(claimed), 1)
+        # The later entry of the group waits for the claimed one
+        self.assertEqual(outbox.claim(batch_size=10), [])
+        self.assertEqual(outbox.drain(), (0, 0))
+
+        # The claim of a worker that died expires
+        OutboxEntry.objects.filter(pk=claimed[0].pk).update(claimed_until=timezone.now())
+        self.assertEqual(outbox.drain(), (2, 0))
+        self.assertEqual(self.group_members(), [user_dn('alice'), user_dn('bob')])
+
+    def testClaimIsReleasedWhileCircuitIsOpen(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team.members.add(self.alice)
+        with mock.patch('gpnmgr.ldap.outbox.apply', side_effect=CircuitOpen('open')):
+            self.assertEqual(outbox.drain(), (0, 0))
+        entry = OutboxEntry.objects.get()
+        self.assertIsNone(entry.claimed_until)
+        self.assertEqual(entry.attempts, 0)
+        self.assertEqual(outbox.drain(), (1, 0))
+
+
+class SuspendSyncTest(TestCase):
+    def testChangesAreNotQueued(self):
+        alice = User.objects.create(username='alice', object_dn=user_dn('alice'))
+        team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        with suspend_sync():
+            with suspend_sync():
+                team.members.add(alice)
+            self.assertTrue(sync_suspended())
+            team.admins.add(alice)
+        self.assertFalse(sync_suspended())
+        self.assertFalse(OutboxEntry.objects.exists())
+        self.assertEqual(LogEntry.objects.get_for_object(team).filter(changes__has_key='admins').count(), 1)
+
+        team.admins.remove(alice)
+        self.assertTrue(OutboxEntry.objects.exists())
+
+
+class UserImporterTest(TestCase):
+    def entries(self, *users):
+        return [(user_dn(username), {'uid': [username], 'sn': [last_name]}) for username, last_name in users]
+
+    def testImportCreatesUpdatesAndSkips(self):
+        User.objects.create(username='alice', last_name='Alice', display_name='Alice', object_dn=user_dn('alice'))
+        User.objects.create(username='bob', last_name='Bob', display_name='Bob', object_dn=user_dn('bob'))
+        entries = self.entries(('alice', 'Alice'), ('bob', 'Robert'), ('carol', 'Carol'))
+        entries.append(('cn=nobody,ou=users,dc=example,dc=com', {}))
+
+        with self.assertNumQueries(1):
+            result = UserImporter().run(entries, dry_run=True)
+        self.assertEqual((result.created, result.updated, result.unchanged), (['carol'], ['bob'], 1))
+        self.assertEqual(result.skipped, ['cn=nobody,ou=users,dc=example,dc=com'])
+        self.assertFalse(User.objects.filter(username='carol').exists())
+
+        UserImporter(batch_size=1).run(entries)
+        carol = User.objects.get(username='carol')
+        self.assertEqual((carol.display_name, carol.object_dn), ('Carol', user_dn('carol')))
+        self.assertFalse(carol.has_usable_password())
+        self.assertEqual(User.objects.get(username='bob').display, 'Robert (bob)')
+
+        result = UserImporter().run(entries)
+        self.assertEqual((result.created, result.updated, result.unchanged), ([], [], 3))
+
+    def testQueriesPerBatchAreConstant(self):
+        with CaptureQueriesContext(connection) as queries:
+            UserImporter().run(self.entries(('alice', 'Alice')))
+        # Loading the batch and the existing users, and one INSERT each into the parent and the child table
+        entries = self.entries(*((f'user{i}', f'User {i}') for i in range(50)))
+        with self.assertNumQueries(len(queries)):
+            UserImporter().run(entries)
+        users = User.objects.filter(username__startswith='user')
+        self.assertEqual(users.count(), 50)
+        self.assertEqual(users.get(username='user7').object_dn, user_dn('user7'))
+
+
+class GroupImporterTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice', object_dn=user_dn('alice'))
+        self.bob = User.objects.create(username='bob', object_dn=user_dn('bob'))
+        # Logged in before the user import, so the DN is not known yet
+        self.carol = User.objects.create(username='carol', display_name='carol')
+        self.team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        self.team.members.add(self.alice, self.bob)
+        self.team.admins.add(self.bob)
+        OutboxEntry.objects.all().delete()
+
+    @staticmethod
+    def group(name, members, owners=()):
+        return (f'cn={name},ou=groups,dc=example,dc=com',
+                {'cn': [name], 'member': [user_dn(member) for member in members],
+                 'owner': [user_dn(owner) for owner in owners]})
+
+    def testImportAppliesDifferences(self):
+        entries = [
+            self.group('kueche', ['alice', 'carol', 'mallory'], ['alice', 'bob']),
+            self.group('infodesk', ['bob'], ['bob']),
+        ]
+        result = GroupImporter().run(entries, dry_run=True)
+        self.assertEqual(result.created, ['infodesk'])
+        self.assertEqual((result.members_added, result.members_removed), (2, 1))
+        self.assertEqual((result.admins_added, result.admins_removed), (2, 1))
+        self.assertEqual(result.unresolved, [('kueche', user_dn('mallory'))])
+        self.assertEqual(result.non_member_admins, [('kueche', user_dn('bob'))])
+        self.assertFalse(Team.objects.filter(ldap_name='infodesk').exists())
+
+        GroupImporter(batch_size=1).run(entries)
+        self.assertEqual(set(self.team.members.all()), {self.alice, self.carol})
+        self.assertEqual(set(self.team.admins.all()), {self.alice})
+        infodesk = Team.objects.get(ldap_name='infodesk')
+        self.assertEqual((list(infodesk.members.all()), list(infodesk.admins.all())), ([self.bob], [self.bob]))
+        self.assertFalse(OutboxEntry.objects.exists())
+        self.assertTrue(LogEntry.objects.filter(object_pk=self.team.pk, changes__icontains='carol').exists())
+
+        result = GroupImporter().run(entries)
+        self.assertEqual((result.members_added, result.members_removed, result.admins_added), (0, 0, 0))
+
+
+class SyncWatermarkTest(TestCase):
+    def testFullSyncDue(self):
+        watermark = SyncWatermark.load(SyncWatermark.USERS)
+        self.assertTrue(watermark.full_sync_due)
+        list(watermark.observe([('uid=a', {'modifyTimestamp': [datetime(2026, 5, 1, 12, tzinfo=dt_timezone.utc)]}),
+                                ('uid=b', {'modifyTimestamp': [datetime(2026, 5, 1, 11, tzinfo=dt_timezone.utc)]}),
+                                ('uid=c', {})]))
+        watermark.advance(full_sync=True)
+
+        watermark = SyncWatermark.load(SyncWatermark.USERS)
+        self.assertFalse(watermark.full_sync_due)
+        self.assertEqual(watermark.modified_at, datetime(2026, 5, 1, 12, tzinfo=dt_timezone.utc))
+        with override_settings(LDAP_SYNC_OVERLAP=60):
+            self.assertEqual(watermark.search_filter('(objectClass=inetOrgPerson)'),
+                             '(&(objectClass=inetOrgPerson)(modifyTimestamp>=20260501115900Z))')
+        with override_settings(LDAP_FULL_SYNC_INTERVAL=0):
+            self.assertTrue(watermark.full_sync_due)
+
+    def testTimestampStringsAreParsed(self):
+        # Without the schema, ldap3 returns modifyTimestamp as it was sent
+        watermark = SyncWatermark.load(SyncWatermark.GROUPS)
+        self.assertEqual(watermark.search_filter('(objectClass=*)'), '(objectClass=*)')
+        with self.assertLogs('gpnmgr.ldap.models.watermark', 'WARNING'):
+            list(watermark.observe([('cn=a', {'modifyTimestamp': ['20260501120000Z']}),
+                                    ('cn=b', {'modifyTimestamp': [b'20260501130000.5+0200']}),
+                                    ('cn=c', {'modifyTimestamp': ['yesterday']})]))
+        watermark.advance(full_sync=False)
+        self.assertEqual(SyncWatermark.load(SyncWatermark.GROUPS).modified_at,
+                         datetime(2026, 5, 1, 12, tzinfo=dt_timezone.utc))
+
+    def testFullSweepReportsDeletions(self):
+        User.objects.create(username='alice', object_dn=user_dn('alice'))
+        User.objects.create(username='bob', object_dn=user_dn('bob'))
+        Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        alice = (user_dn('alice'), {'uid': ['alice'], 'sn': ['alice']})
+
+        self.assertEqual(UserImporter().run([alice]).missing, [])
+        result = UserImporter().run([alice], full_sweep=True)
+        self.assertEqual(result.missing, ['bob'])
+        self.assertIsNone(User.objects.get(username='bob').object_dn)
+
+        self.assertEqual(GroupImporter().run([], full_sweep=True).missing, ['kueche'])
+
+
+    def testFailedSearchDoesNotSweep(self):
+        User.objects.create(username='bob', object_dn=user_dn('bob'))
+
+        def source():
+            yield user_dn('alice'), {'uid': ['alice'], 'sn': ['alice']}
+            raise LDAPSizeLimitExceededResult(result=4, description='sizeLimitExceeded')
+
+        with self.assertRaises(LDAPSizeLimitExceededResult):
+            UserImporter(batch_size=1).run(source(), full_sweep=True)
+        self.assertEqual(User.objects.get(username='bob').object_dn, user_dn('bob'))
+
+class ParallelGroupImportTest(TransactionTestCase):
+    def testJobsMergeIntoOneResult(self):
+        users = [User.objects.create(username=f'user{i}', object_dn=user_dn(f'user{i}')) for i in range(4)]
+        entries = [
+            GroupImporterTest.group(f'team{i}', [f'user{j}' for j in range(i + 1)], [f'user{i}', 'nobody'])
+            for i in range(4)
+        ]
+        result = GroupImporter(batch_size=1).run(entries, jobs=3)
+        self.assertEqual(result.created, ['team0', 'team1', 'team2', 'team3'])
+        self.assertEqual((result.members_added, result.admins_added), (10, 4))
+        self.assertEqual(len(result.unresolved), 4)
+        for i in range(4):
+            team = Team.objects.get(ldap_name=f'team{i}')
+            self.assertEqual(set(team.members.all()), set(users[:i + 1]))
+            self.assertEqual(list(team.admins.all()), [users[i]])
+
+        result = GroupImporter(batch_size=1).run(entries, jobs=3)
+        self.assertEqual((result.created, result.members_added, result.admins_added), ([], 0, 0))
+
+
+class FakePersistentSearch:
+    def __init__(self, messages):
+        self.messages = messages
+        self.stopped = False
+
+    def next(self, block=False, timeout=None):
+        message = self.messages.pop(0)
+        if isinstance(message, BaseException):
+            raise message
+        return message
+
+    def stop(self):
+        self.stopped = True
+
+
+class DirectoryWatcherTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice', object_dn=user_dn('alice'))
+        self.team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        self.watcher = DirectoryWatcher(timeout=0)
+
+    def testApplyChanges(self):
+        self.watcher.apply(Change(ADD, user_dn('bob'), {'uid': ['bob'], 'sn': ['bob']}))
+        bob = User.objects.get(username='bob')
+        self.assertEqual(bob.object_dn, user_dn('bob'))
+
+        self.watcher.apply(Change(MODIFY, GROUP_DN, {'cn': ['kueche'], 'member': [user_dn('alice'), user_dn('bob')],
+                                                     'owner': [user_dn('bob')]}))
+        self.assertEqual(set(self.team.members.all()), {self.alice, bob})
+        self.assertEqual(list(self.team.admins.all()), [bob])
+        self.assertFalse(OutboxEntry.objects.exists())
+
+        self.watcher.apply(Change(MODIFY_DN, 'cn=spuele,ou=groups,dc=example,dc=com',
+                                  {'cn': ['spuele'], 'member': [user_dn('alice')]}, previous_dn=GROUP_DN))
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.ldap_name, 'spuele')
+        self.assertEqual(list(self.team.members.all()), [self.alice])
+
+        self.watcher.apply(Change(DELETE, user_dn('bob'), {'uid': ['bob']}))
+        self.assertIsNone(User.objects.get(username='bob').object_dn)
+
+        # Outside of the user and group OUs
+        self.watcher.apply(Change(ADD, 'uid=eve,ou=other,dc=example,dc=com', {'uid': ['eve']}))
+        self.assertFalse(User.objects.filter(username='eve').exists())
+
+    def testReconnectsAfterLostConnection(self):
+        change = {'type': 'searchResEntry', 'changeType': ADD, 'dn': user_dn('bob'),
+                  'attributes': {'uid': ['bob'], 'sn': 'bob',
+                                 'modifyTimestamp': datetime(2026, 5, 1, 12, tzinfo=dt_timezone.utc)}}
+        searches = [FakePersistentSearch([None, LDAPSocketReceiveError('gone')]),
+                    FakePersistentSearch([change, KeyboardInterrupt()])]
+        conn = mock.Mock(closed=False)
+        conn.extend.standard.persistent_search.side_effect = searches
+
+        with mock.patch('gpnmgr.ldap.watch.backoff', return_value=0), self.assertRaises(KeyboardInterrupt):
+            DirectoryWatcher(connect=lambda: conn, timeout=0).run()
+        self.assertTrue(all(search.stopped for search in searches))
+        self.assertEqual(User.objects.get(username='bob').last_name, 'bob')
+        self.assertEqual(SyncWatermark.load(SyncWatermark.USERS).modified_at,
+                         datetime(2026, 5, 1, 12, tzinfo=dt_timezone.utc))
+
+    def testReconnectsAfterDatabaseError(self):
+        change = {'type': 'searchResEntry', 'changeType': ADD, 'dn': user_dn('bob'),
+                  'attributes': {'uid': ['bob'], 'sn': 'bob'}}
+        searches = [FakePersistentSearch([change]), FakePersistentSearch([change, KeyboardInterrupt()])]
+        conn = mock.Mock(closed=False)
+        conn.extend.standard.persistent_search.side_effect = searches
+        original = DirectoryWatcher.import_entries
+        errors = [OperationalError('server closed the connection')]
+
+        def import_entries(watcher, *args):
+            if errors:
+                raise errors.pop()
+            return original(watcher, *args)
+
+        with mock.patch('gpnmgr.ldap.watch.backoff', return_value=0), \
+                mock.patch.object(DirectoryWatcher, 'import_entries', import_entries), \
+                self.assertRaises(KeyboardInterrupt):
+            DirectoryWatcher(connect=lambda: conn, timeout=0).run()
+        self.assertTrue(all(search.stopped for search in searches))
+        self.assertEqual(User.objects.get(username='bob').last_name, 'bob')
+
+    def testFailedBindIsNotIgnored(self):
+        conn = mock.Mock(bound=False, result={'result': 49, 'description': 'invalidCredentials'})
+        conn.bind.return_value = False
+        with self.assertRaises(LDAPInvalidCredentialsResult):
+            DirectoryWatcher(connect=lambda: conn, timeout=0).watch()
+        conn.extend.standard.persistent_search.assert_not_called()
+
+
+class PlanTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice', object_dn=user_dn('alice'))
+        self.team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        self.team.members.add(self.alice)
+        self.team.admins.add(self.alice)
+        OutboxEntry.objects.all().delete()
+
+    def testDryRunPlanCanBeAppliedLater(self):
+        users = [(user_dn(username), {'uid': [username], 'sn': [username.title()]}) for username in ('alice', 'bob')]
+        with self.assertNumQueries(1):
+            result = UserImporter().run(users, dry_run=True)
+        self.assertEqual(set(result.plan.create_users), {'bob'})
+        self.assertEqual(set(result.plan.update_users), {'alice'})
+        result.plan.apply()
+        bob = User.objects.get(username='bob')
+
+        groups = [GroupImporterTest.group('kueche', ['bob'], ['bob']), GroupImporterTest.group('infodesk', ['alice'])]
+        plan = GroupImporter().run(groups, dry_run=True).plan
+        self.assertEqual(plan.create_teams, ['infodesk'])
+        self.assertEqual(plan.teams, {
+            'kueche': {
+                'members': {'add': ['bob'], 'remove': ['alice']},
+                'admins': {'add': ['bob'], 'remove': ['alice']},
+            },
+            'infodesk': {'members': {'add': ['alice'], 'remove': []}},
+        })
+        self.assertEqual(list(self.team.members.all()), [self.alice])
+
+        fp = io.StringIO()
+        plan.dump(fp)
+        fp.seek(0)
+        Plan.load(fp).apply()
+        self.assertEqual((list(self.team.members.all()), list(self.team.admins.all())), ([bob], [bob]))
+        self.assertEqual(list(Team.objects.get(ldap_name='infodesk').members.all()), [self.alice])
+        self.assertFalse(OutboxEntry.objects.exists())
+
+        # Applying twice changes nothing
+        plan.apply()
+        self.assertFalse(GroupImporter().run(groups, dry_run=True).plan)
+
+    def testInvalidPlan(self):
+        with self.assertRaises(PlanError):
+            Plan.load(io.StringIO('{"version": 0}'))
+        with self.assertRaises(PlanError):
+            Plan.load(io.StringIO('not json'))
+
+
+LDIF = """version: 1
+# extended LDIF
+#
+# LDAPv3
+# base <dc=example,dc=com> with scope subtree
+
+# alice, users, example.com
+dn: uid=alice,ou=users,dc=example,dc=com
+objectClass: inetOrgPerson
+uid: alice
+sn: Alice
+
+dn: uid=bob,ou=users,dc=example,dc=com
+objectclass: top
+objectclass: inetOrgPerson
+UID: bob
+sn:: QsO2Yg==
+
+dn: uid=carol,ou=users,dc=example,dc=com
+changetype: modify
+replace: sn
+sn: Carol
+
+dn: cn=kueche,ou=groups,dc=example,dc=com
+objectClass: groupOfNames
+cn: kueche
+member: uid=alice,ou=users,dc=exa
+ mple,dc=com
+member: uid=bob,ou=users,dc=example,dc=com
+owner: uid=bob,ou=users,dc=example,dc=com
+
+dn: cn=admin,dc=example,dc=com
+objectClass: inetOrgPerson
+sn: admin
+
+# search result
+search: 2
+result: 0 Success
+"""
+
+
+class LdifImportTest(TestCase):
+    def testReadLdif(self):
+        entries = list(read_ldif(io.StringIO(LDIF)))
+        self.assertEqual([dn for dn, _ in entries], [user_dn('alice'), user_dn('bob'), GROUP_DN, BIND_DN])
+        self.assertEqual(entries[1][1]['uid'], ['bob'])
+        self.assertEqual(entries[1][1]['sn'], ['Böb'])
+        self.assertEqual(entries[2][1]['member'], [user_dn('alice'), user_dn('bob')])
+
+        users = search_ldif(io.StringIO(LDIF), 'ou=users,dc=example,dc=com', 'inetOrgPerson')
+        self.assertEqual([dn for dn, _ in users], [user_dn('alice'), user_dn('bob')])
+
+        with self.assertRaises(LdifError):
+            list(read_ldif(io.StringIO('dn: cn=broken\nno separator\n')))
+
+    def testImportCommands(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ldif') as fp:
+            fp.write(LDIF)
+            fp.flush()
+            with contextlib.redirect_stdout(io.StringIO()):
+                call_command('import_ldap_users', '--ldif', fp.name)
+                call_command('import_ldap_groups', '--ldif', fp.name)
+
+        bob = User.objects.get(username='bob')
+        self.assertEqual(bob.last_name, 'Böb')
+        team = Team.objects.get(ldap_name='kueche')
+        self.assertEqual(set(team.members.values_list('username', flat=True)), {'alice', 'bob'})
+        self.assertEqual(list(team.admins.all()), [bob])
+        self.assertIsNone(SyncWatermark.load(SyncWatermark.USERS).modified_at)
+
+    @skipUnless(connection.vendor == 'sqlite', 'Jobs are only ignored on SQLite')
+    def testJobsAreIgnoredOnSqlite(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ldif') as fp:
+            fp.write(LDIF)
+            fp.flush()
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                call_command('import_ldap_groups', '--ldif', fp.name, '--jobs', '4')
+        self.assertIn('Ignoring --jobs', out.getvalue())
+
+    def testLdifIsOnlySweptOnRequest(self):
+        carol = User.objects.create(username='carol', object_dn=user_dn('carol'))
+        with tempfile.NamedTemporaryFile('w', suffix='.ldif') as fp:
+            fp.write(LDIF)
+            fp.flush()
+            with contextlib.redirect_stdout(io.StringIO()):
+                call_command('import_ldap_users', '--ldif', fp.name)
+                carol.refresh_from_db()
+                self.assertEqual(carol.object_dn, user_dn('carol'))
+
+                call_command('import_ldap_users', '--ldif', fp.name, '--sweep')
+                carol.refresh_from_db()
+                self.assertIsNone(carol.object_dn)
+
+
+class ReconcileTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice', object_dn=user_dn('alice'))
+        self.bob = User.objects.create(username='bob', object_dn=user_dn('Bob'))
+        self.team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        self.team.members.add(self.alice, self.bob)
+        self.team.admins.add(self.alice)
+        self.empty = Team.objects.create(name='Infodesk', slug='infodesk', ldap_name='infodesk')
+        Team.objects.create(name='Orga', slug='orga', ldap_name='orga')
+        OutboxEntry.objects.all().delete()
+
+    def testMergeDiff(self):
+        ours = sorted_dns(['b', 'd', 'a', 'A', None])
+        theirs = sorted_dns(['c', 'a', 'e', settings.LDAP_PLACEHOLDER_DN])
+        self.assertEqual(merge_diff(ours, theirs), (['b', 'd'], ['c', 'e']))
+
+    def testReportAndRepair(self):
+        pages = [[
+            (GROUP_DN, {'cn': ['kueche'], 'member': [user_dn('bob'), user_dn('carol')],
+                        'owner': [user_dn('alice')]}),
+        ], [
+            ('cn=infodesk,ou=groups,dc=example,dc=com', {'cn': ['infodesk'], 'member': [user_dn('carol')]}),
+            ('cn=unknown,ou=groups,dc=example,dc=com', {'cn': ['unknown'], 'member': [user_dn('carol')]}),
+        ]]
+        drifted = []
+        result = Reconciler().run(pages, report=drifted.append)
+        self.assertEqual(result.checked, 2)
+        self.assertEqual(result.missing, ['orga'])
+        self.assertEqual(result.drifted, 2)
+        kueche, infodesk = drifted
+        self.assertEqual(kueche.missing, {'member': [user_dn('alice')], 'owner': []})
+        self.assertEqual(kueche.extra, {'member': [user_dn('carol')], 'owner': []})
+        self.assertEqual(infodesk.extra['member'], [user_dn('carol')])
+        self.assertFalse(OutboxEntry.objects.exists())
+
+        # Teams with pending changes are not compared
+        OutboxEntry.objects.create(team=self.team, group_name='kueche', changes={})
+        drifted = []
+        result = Reconciler().run(pages, report=drifted.append)
+        self.assertEqual(result.pending, ['kueche'])
+        self.assertEqual([drift.team for drift in drifted], [self.empty])
+
+
+class ReconcileRepairTest(TransactionTestCase):
+    # Each chunk is committed on its own, which a TestCase's enclosing transaction would prevent
+
+    def testRepair(self):
+        alice = User.objects.create(username='alice', object_dn=user_dn('alice'))
+        team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        team.members.add(alice)
+        empty = Team.objects.create(name='Infodesk', slug='infodesk', ldap_name='infodesk')
+        OutboxEntry.objects.all().delete()
+        pages = [[
+            (GROUP_DN, {'cn': ['kueche'], 'member': [user_dn('carol')]}),
+            ('cn=infodesk,ou=groups,dc=example,dc=com', {'cn': ['infodesk'], 'member': [user_dn('carol')]}),
+        ]]
+
+        result = Reconciler(batch_size=1).run(pages, repair=True)
+        self.assertEqual(result.repaired, 4)
+        entries = list(OutboxEntry.objects.order_by('id'))
+        self.assertEqual([(entry.team, entry.changes['member']) for entry in entries], [
+            (team, {'add': [user_dn('alice')], 'delete': []}),
+            (team, {'add': [], 'delete': [user_dn('carol')]}),
+            (empty, {'add': [settings.LDAP_PLACEHOLDER_DN], 'delete': []}),
+            (empty, {'add': [], 'delete': [user_dn('carol')]}),
+        ])
@@ -0,0 +1,11 @@
+from typing import Any, List
+
+from django.urls import path
+
+from gpnmgr.ldap.views.status import LdapStatusView
+
+
+urlpatterns: List[Any] = [
+    # status
+    path('status', LdapStatusView.as_view(), name='ldap_status'),
+]
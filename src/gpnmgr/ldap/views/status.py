@@ -0,0 +1,26 @@
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.http import JsonResponse
+from django.views import View
+
+from gpnmgr.ldap import READ, WRITE, get_pool
+from gpnmgr.ldap.models import OutboxEntry
+from gpnmgr.ldap.resilience import breakers
+
+
+class LdapStatusView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    permission_required = 'log.view_log'
+    http_method_names = ('get', )
+
+    def get(self, request, *args, **kwargs):
+        # Pool and breaker are per process, so this describes the worker serving the request
+        sync_status = OutboxEntry.objects.status()
+        return JsonResponse({
+            'pools': {role: get_pool(role).stats for role in (READ, WRITE)},
+            'breakers': {role: breaker.stats for role, breaker in breakers.items()},
+            'outbox': {
+                'pending': sync_status.pending,
+                'failing': sync_status.failing,
+                'abandoned': sync_status.abandoned,
+                'lag': sync_status.lag.total_seconds() if sync_status.lag is not None else None,
+            },
+        })
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import logging
+import threading
+from functools import partial
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from ldap3 import ASYNC_STREAM, Connection
+from ldap3.core.exceptions import LDAPException
+
+from gpnmgr.accounts.models import User
+from gpnmgr.teams.models import Team
+
+from . import pool
+from .cache import group_dn_cache
+from .importers import GroupImporter, GroupImportResult, UserImporter, UserImportResult
+from .importers.groups import UserResolver, normalize_dn
+from .importers.users import batches
+from .models import SyncWatermark
+from .models.watermark import MODIFY_TIMESTAMP
+from .resilience import backoff
+from .search import entries, normalize_attributes, paged_search
+
+logger = logging.getLogger(__name__)
+
+ADD = 'add'
+DELETE = 'delete'
+MODIFY = 'modify'
+MODIFY_DN = 'modify dn'
+
+
+class Change(NamedTuple):
+    change_type: str
+    dn: str
+    attributes: dict[str, list]
+    previous_dn: Optional[str] = None
+
+
+class DirectoryWatcher:
+    """
+    Applies changes to the user and group OUs as the directory reports them.
+
+    Changes are received with a persistent search (draft-ietf-ldapext-psearch) on a dedicated connection and applied
+    with the importers, one entry at a time, advancing the incremental watermarks. After (re)connecting, the entries
+    modified since the watermarks are imported first, so a restart or an outage does not need a full rescan.
+    Deletions missed while nobody was watching are caught by the next import with `--sweep`.
+    """
+
+    def __init__(self, connect: Optional[Callable[[], Connection]] = None, timeout: Optional[float] = None) -> None:
+        self.connect = connect or partial(pool.connect, pool.READ, client_strategy=ASYNC_STREAM)
+        self.timeout = settings.LDAP_WATCH_TIMEOUT if timeout is None else timeout
+        self.bases = {
+            SyncWatermark.USERS: (f'{settings.LDAP_USER_OU},{settings.LDAP_BASE_DN}', settings.LDAP_USER_OBJECT_CLASS),
+            SyncWatermark.GROUPS: (f'{settings.LDAP_GROUP_OU},{settings.LDAP_BASE_DN}',
+                                   settings.LDAP_GROUP_OBJECT_CLASS),
+        }
+        self.attributes = {
+            SyncWatermark.USERS: ['sn', settings.LDAP_USER_PK, MODIFY_TIMESTAMP],
+            SyncWatermark.GROUPS: [settings.LDAP_GROUP_PK, settings.LDAP_GROUP_MEMBER_KEY,
+                                   settings.LDAP_GROUP_MANAGER_KEY, MODIFY_TIMESTAMP],
+        }
+        self.users = UserImporter()
+        self.groups = GroupImporter()
+        self.resolver: Optional[UserResolver] = None
+        self.stopped = threading.Event()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def source(self, dn: str) -> Optional[str]:
+        dn = normalize_dn(dn)
+        for source, (base, _) in self.bases.items():
+            if dn.endswith(',' + normalize_dn(base)):
+                return source
+        return None
+
+    def run(self) -> None:
+        attempt = 0
+        while not self.stopped.is_set():
+            try:
+                self.watch()
+                attempt = 0
+            except Exception as e:
+                delay = backoff(attempt)
+                if isinstance(e, LDAPException):
+                    logger.warning('Lost the LDAP persistent search (%s), reconnecting in %.1fs', e, delay)
+                else:
+                    # E.g. a DatabaseError while applying a change, which the catch up after reconnecting applies again
+                    logger.exception('Could not apply an LDAP change, reconnecting in %.1fs', delay)
+                close_old_connections()
+                attempt += 1
+                self.stopped.wait(delay)
+
+    def watch(self) -> None:
+        conn = self.connect()
+        # Otherwise the persistent search binds by itself, ignoring a failed bind
+        pool.bind(conn)
+        object_classes = ''.join(f'(objectClass={object_class})' for _, object_class in self.bases.values())
+        search = conn.extend.standard.persistent_search(
+            search_base=settings.LDAP_BASE_DN,
+            search_filter=f'(|{object_classes})',
+            attributes=sorted({attribute for attributes in self.attributes.values() for attribute in attributes}),
+            streaming=False,
+            changes_only=True,
+        )
+        try:
+            # The search is started first, so changes made during the catch up are queued and not lost
+            self.catch_up()
+            logger.info('Watching %s for changes', settings.LDAP_BASE_DN)
+            while not self.stopped.is_set():
+                message = search.next(block=True, timeout=self.timeout)
+                if message is None:
+                    if conn.closed:
+                        raise LDAPException('connection closed')
+                    continue
+                close_old_connections()
+                self.apply(self.change(message))
+        finally:
+            try:
+                search.stop()
+            except LDAPException:
+                pass
+
+    @staticmethod
+    def change(message: dict) -> Change:
+        previous_dn = message.get('previousDN')
+        return Change(
+            change_type=message.get('changeType', ADD),
+            dn=message['dn'],
+            attributes=normalize_attributes(message['dn'], message.get('attributes', {})),
+            previous_dn=str(previous_dn) if previous_dn is not None else None,
+        )
+
+    def catch_up(self) -> None:
+        """
+        Imports the entries modified since the watermarks
+        """
+        for source, (base, object_class) in self.bases.items():
+            watermark = SyncWatermark.load(source)
+            if watermark.modified_at is None:
+                logger.warning('No %s watermark, run a full import first', source)
+                continue
+            search_filter = watermark.search_filter(f'(objectClass={object_class})')
+            result = self.import_entries(source, watermark, entries(paged_search(base, search_filter,
+                                                                                 self.attributes[source])))
+            logger.info('Caught up on %s: %s', source, result)
+
+    def apply(self, change: Change) -> None:
+        source = self.source(change.dn)
+        if source is None:
+            return
+        if change.change_type == DELETE:
+            self.delete(source, change.dn, change.attributes)
+            return
+        if change.change_type == MODIFY_DN and change.previous_dn:
+            self.rename(source, change.previous_dn, change.dn, change.attributes)
+        result = self.import_entries(source, SyncWatermark.load(source), [(change.dn, change.attributes)])
+        logger.info('Applied %s of %s: %s', change.change_type, change.dn, result)
+
+    def import_entries(self, source: str, watermark: SyncWatermark,
+                       source_entries: Iterable[tuple[str, dict[str, list]]]) -> UserImportResult | GroupImportResult:
+        if source == SyncWatermark.USERS:
+            user_result = self.users.run(watermark.observe(source_entries))
+            # New and renamed users have to be resolvable as group members
+            self.resolver = None
+            watermark.advance(full_sync=False)
+            return user_result
+
+        resolver = self.resolver = self.resolver or UserResolver()
+        group_result = GroupImportResult()
+        for batch in batches(watermark.observe(source_entries), self.groups.batch_size):
+            group_result.merge(self.groups.import_batch(batch, resolver, dry_run=False))
+        watermark.advance(full_sync=False)
+        return group_result
+
+    def delete(self, source: str, dn: str, attributes: dict[str, list]) -> None:
+        if source == SyncWatermark.USERS:
+            username: Optional[str] = (attributes.get(settings.LDAP_USER_PK) or [None])[0]
+            if username is None:
+                return
+            User.objects.filter(username=username, object_dn__iexact=dn).update(object_dn=None)
+            self.resolver = None
+            logger.info('User %s was deleted from LDAP', username)
+        else:
+            # Like the full sweep, the team is kept
+            group_name: Optional[str] = (attributes.get(settings.LDAP_GROUP_PK) or [None])[0]
+            if group_name is None:
+                return
+            group_dn_cache.invalidate(group_name)
+            logger.warning('Group %s was deleted from LDAP, team kept', group_name)
+
+    def rename(self, source: str, previous_dn: str, dn: str, attributes: dict[str, list]) -> None:
+        if source != SyncWatermark.GROUPS:
+            # Users are matched by username, the import updates the DN
+            return
+        previous_name = previous_dn.split(',')[0].partition('=')[2].strip()
+        group_name: Optional[str] = (attributes.get(settings.LDAP_GROUP_PK) or [None])[0]
+        if not group_name:
+            return
+        if previous_name != group_name:
+            Team.objects.filter(ldap_name=previous_name).update(ldap_name=group_name, version=F('version') + 1)
+            group_dn_cache.invalidate(previous_name)
+        group_dn_cache.invalidate(group_name)
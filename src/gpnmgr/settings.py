@@ -42,7 +42,8 @@ INSTALLED_APPS = [
     "django_bootstrap5",
     "gpnmgr.accounts",
     "gpnmgr.teams",
-    "gpnmgr.log"
+    "gpnmgr.log",
+    "gpnmgr.ldap",
 ]
 
 MIDDLEWARE = [
@@ -184,9 +185,25 @@ LOGIN_URL = reverse_lazy('login')
 LOGIN_REDIRECT_URL = reverse_lazy('user_profile')
 OAUTH_GROUP_IGNORE_REGEX = r'ignore group regex'
 
+# Teams per page of the team list
+TEAMS_PAGE_SIZE = int(os.environ.get('TEAMS_PAGE_SIZE', '50'))
+# Members per page of the members card of the team detail, further pages are loaded while scrolling
+TEAM_MEMBERS_PAGE_SIZE = int(os.environ.get('TEAM_MEMBERS_PAGE_SIZE', '50'))
+# CACHES alias and lifetime in seconds of rendered team list rows and team detail cards. Keys contain a version of the
+# team, so sharing the cache between processes only raises the hit rate.
+TEAMS_FRAGMENT_CACHE = os.environ.get('TEAMS_FRAGMENT_CACHE', 'default')
+TEAMS_FRAGMENT_CACHE_TTL = int(os.environ.get('TEAMS_FRAGMENT_CACHE_TTL', '86400'))
+
 LDAP_BIND_DN = os.environ.get('LDAP_BIND_DN', '')
 LDAP_BIND_PASSWORD = os.environ.get('LDAP_BIND_PASSWORD', '')
 LDAP_BIND_URL = os.environ.get('LDAP_BIND_URL', '')
+# Comma separated. Further writable servers to fail over to, and read replicas for searches, which default to the
+# writable ones
+LDAP_WRITE_FAILOVER_URLS = [url for url in os.environ.get('LDAP_WRITE_FAILOVER_URLS', '').split(',') if url]
+LDAP_READ_URLS = [url for url in os.environ.get('LDAP_READ_URLS', '').split(',') if url]
+# Rounds through a server pool looking for a reachable server, and seconds an unreachable one is skipped
+LDAP_SERVER_POOL_CYCLES = int(os.environ.get('LDAP_SERVER_POOL_CYCLES', '2'))
+LDAP_SERVER_EXHAUST_TIME = int(os.environ.get('LDAP_SERVER_EXHAUST_TIME', '60'))
 LDAP_BASE_DN = os.environ.get('LDAP_BASE_DN', 'dc=example,dc=com')
 LDAP_USER_PK = os.environ.get('LDAP_USER_PK', 'uid')
 LDAP_USER_OU = os.environ.get('LDAP_USER_OU', 'ou=users')
@@ -199,6 +216,51 @@ LDAP_GROUP_OBJECT_CLASS = os.environ.get('LDAP_GROUP_OBJECT_CLASS', 'groupOfName
 LDAP_PLACEHOLDER_DN = os.environ.get('LDAP_PLACEHOLDER_DN', 'cn=null,dc=example,dc=com')
 LDAP_GROUP_MEMBER_REQUIRED = os.environ.get('LDAP_GROUP_MEMBER_REQUIRED', 'true').lower() in ['true', 'y', 'yes']
 
+# Per-process pool of bound LDAP connections, see gpnmgr.ldap.pool
+LDAP_POOL_SIZE = int(os.environ.get('LDAP_POOL_SIZE', '4'))
+LDAP_POOL_MAX_IDLE = float(os.environ.get('LDAP_POOL_MAX_IDLE', '300'))
+LDAP_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('LDAP_POOL_HEALTH_CHECK_INTERVAL', '30'))
+LDAP_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('LDAP_POOL_ACQUIRE_TIMEOUT', '10'))
+# Timeouts in seconds, retries of transient failures and the circuit breaker around all LDAP operations
+LDAP_CONNECT_TIMEOUT = float(os.environ.get('LDAP_CONNECT_TIMEOUT', '5'))
+LDAP_RECEIVE_TIMEOUT = float(os.environ.get('LDAP_RECEIVE_TIMEOUT', '10'))
+LDAP_RETRIES = int(os.environ.get('LDAP_RETRIES', '2'))
+LDAP_RETRY_DELAY = float(os.environ.get('LDAP_RETRY_DELAY', '0.2'))
+LDAP_RETRY_MAX_DELAY = float(os.environ.get('LDAP_RETRY_MAX_DELAY', '2'))
+LDAP_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('LDAP_BREAKER_FAILURE_THRESHOLD', '5'))
+LDAP_BREAKER_RESET_TIMEOUT = float(os.environ.get('LDAP_BREAKER_RESET_TIMEOUT', '30'))
+# Rows per bulk insert/update of the import commands
+LDAP_IMPORT_BATCH_SIZE = int(os.environ.get('LDAP_IMPORT_BATCH_SIZE', '500'))
+# Entries per page of the paged searches of the import commands, must stay below the server's size limit
+LDAP_SEARCH_PAGE_SIZE = int(os.environ.get('LDAP_SEARCH_PAGE_SIZE', '500'))
+# `--incremental` imports only read entries modified since the last run, overlapping it by LDAP_SYNC_OVERLAP seconds,
+# and fall back to a full read every LDAP_FULL_SYNC_INTERVAL seconds, which with `--sweep` also catches deletions
+LDAP_SYNC_OVERLAP = float(os.environ.get('LDAP_SYNC_OVERLAP', '300'))
+LDAP_FULL_SYNC_INTERVAL = float(os.environ.get('LDAP_FULL_SYNC_INTERVAL', '3600'))
+# Seconds `manage.py ldap_watch` waits for a change before checking its connection
+LDAP_WATCH_TIMEOUT = float(os.environ.get('LDAP_WATCH_TIMEOUT', '30'))
+# Root DSE and schema are read once per server and cached as JSON, refreshed in the background after
+# LDAP_SCHEMA_MAX_AGE seconds or with `manage.py ldap_refresh_schema`. Failed reads are retried after
+# LDAP_SCHEMA_RETRY_DELAY seconds
+LDAP_SCHEMA_CACHE_DIR = os.environ.get('LDAP_SCHEMA_CACHE_DIR', BASE_DIR / 'ldap-schema')
+LDAP_SCHEMA_MAX_AGE = float(os.environ.get('LDAP_SCHEMA_MAX_AGE', '86400'))
+LDAP_SCHEMA_RETRY_DELAY = float(os.environ.get('LDAP_SCHEMA_RETRY_DELAY', '300'))
+# Team.ldap_name -> group DN cache; set LDAP_GROUP_DN_SHARED_CACHE to a CACHES alias to share it between processes
+LDAP_GROUP_DN_CACHE_TTL = float(os.environ.get('LDAP_GROUP_DN_CACHE_TTL', '3600'))
+LDAP_GROUP_DN_SHARED_CACHE = os.environ.get('LDAP_GROUP_DN_SHARED_CACHE', '')
+# Outbox drained by `manage.py ldap_sync_outbox`
+LDAP_OUTBOX_BATCH_SIZE = int(os.environ.get('LDAP_OUTBOX_BATCH_SIZE', '100'))
+LDAP_OUTBOX_POLL_INTERVAL = float(os.environ.get('LDAP_OUTBOX_POLL_INTERVAL', '1'))
+LDAP_OUTBOX_RETRY_DELAY = float(os.environ.get('LDAP_OUTBOX_RETRY_DELAY', '5'))
+LDAP_OUTBOX_MAX_RETRY_DELAY = float(os.environ.get('LDAP_OUTBOX_MAX_RETRY_DELAY', '900'))
+# Seconds a worker may take to apply the entries it claimed before other workers take them over
+LDAP_OUTBOX_CLAIM_TIMEOUT = float(os.environ.get('LDAP_OUTBOX_CLAIM_TIMEOUT', '300'))
+# Entries failing this often are abandoned, see `manage.py ldap_sync_outbox --status` and `--retry-abandoned`
+LDAP_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('LDAP_OUTBOX_MAX_ATTEMPTS', '10'))
+LDAP_OUTBOX_RETENTION_DAYS = int(os.environ.get('LDAP_OUTBOX_RETENTION_DAYS', '7'))
+# Send the coalesced changes of a request right after commit instead of leaving them to the worker
+LDAP_SYNC_ON_COMMIT = os.environ.get('LDAP_SYNC_ON_COMMIT', 'false').lower() in ['true', 'y', 'yes']
+
 try:
     from bootstrap.settings import BOOTSTRAP5
 
@@ -207,11 +269,6 @@ try:
 except ImportError:
     pass
 
-from ldap3 import Server, Connection, ALL, SAFE_RESTARTABLE, AUTO_BIND_NONE
-
-server = Server(LDAP_BIND_URL, get_info=ALL)
-LDAP_CONNECTION = Connection(server, LDAP_BIND_DN, LDAP_BIND_PASSWORD, auto_bind=AUTO_BIND_NONE)
-
 from .permissions import permissions
 PERMISSIONS = permissions
 COMMON_PERMISSIONS: list[str] = []
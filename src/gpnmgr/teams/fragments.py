@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest
+from django.template.loader import render_to_string
+from django.utils.safestring import SafeString, mark_safe
+from django.utils.translation import get_language
+
+from .models import Team
+
+# What a viewer may do with a team, the only thing besides team and language that rendered fragments depend on
+MANAGER = 'manager'
+ADMIN = 'admin'
+MEMBER = 'member'
+
+
+def permission_tier(manage_teams: bool, is_team_admin: bool = False) -> str:
+    if manage_teams:
+        return MANAGER
+    return ADMIN if is_team_admin else MEMBER
+
+
+def fragment_key(name: str, team: Team, tier: str) -> str:
+    return f'teams:fragment:{name}:{team.pk}:{team.version}:{get_language()}:{tier}'
+
+
+def render_fragments(name: str, template_name: str, teams: Iterable[Team], tier: str, context: dict[str, Any],
+                     request: HttpRequest) -> list[SafeString]:
+    """
+    Renders `template_name` per team, with the team as `object`, reusing renderings from the fragment cache.
+
+    Keys contain the team's version, which every change of the team, its memberships or its members increases, so a
+    cached fragment is never stale and nothing has to be deleted. As versions are stored in the database, this holds
+    for any number of processes, whether they share TEAMS_FRAGMENT_CACHE or not. All fragments are fetched with one
+    get_many().
+    """
+    cache = caches[settings.TEAMS_FRAGMENT_CACHE]
+    keys = {fragment_key(name, team, tier): team for team in teams}
+    fragments = cache.get_many(keys)
+    missing = {
+        key: render_to_string(template_name, {**context, 'object': team}, request=request)
+        for key, team in keys.items() if key not in fragments
+    }
+    if missing:
+        cache.set_many(missing, settings.TEAMS_FRAGMENT_CACHE_TTL)
+        fragments.update(missing)
+    return [mark_safe(fragments[key]) for key in keys]
+
+
+def render_fragment(name: str, template_name: str, team: Team, tier: str, context: dict[str, Any],
+                    request: HttpRequest) -> SafeString:
+    return render_fragments(name, template_name, [team], tier, context, request)[0]
@@ -1,11 +1,16 @@
+from contextlib import ExitStack
+
 from django.conf import settings
 from django.core.management import BaseCommand
-from django.utils.translation import gettext_lazy as _
-from ldap3 import SUBTREE
+from django.db import connection
 
-from gpnmgr.accounts.models import User
-from gpnmgr.settings import LDAP_GROUP_MEMBER_KEY, LDAP_GROUP_MANAGER_KEY, LDAP_GROUP_PK, LDAP_USER_PK
-from gpnmgr.teams.models import Team
+from gpnmgr.ldap import group_dn_cache
+from gpnmgr.ldap.importers import GroupImporter
+from gpnmgr.ldap.ldif import search_ldif
+from gpnmgr.ldap.models import SyncWatermark
+from gpnmgr.ldap.models.watermark import MODIFY_TIMESTAMP
+from gpnmgr.ldap.search import entries, paged_search, prefetch
+from gpnmgr.settings import LDAP_GROUP_MEMBER_KEY, LDAP_GROUP_MANAGER_KEY, LDAP_GROUP_PK
 
 
 class Command(BaseCommand):
@@ -13,61 +18,94 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--dry-run', action='store_true', help='Don\'t write any changes')
+        parser.add_argument('--plan', dest='plan_file', metavar='FILE',
+                            help='Write the changes as JSON plan to FILE instead of applying them, see ldap_apply_plan')
+        parser.add_argument('--batch-size', type=int, default=settings.LDAP_IMPORT_BATCH_SIZE,
+                            help='Number of groups per batch')
+        parser.add_argument('--page-size', type=int, default=settings.LDAP_SEARCH_PAGE_SIZE,
+                            help='Number of entries per LDAP search page')
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='Number of batches imported in parallel, not on SQLite')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only read entries modified since the last run, unless a full read is due')
+        parser.add_argument('--ldif', dest='ldif_file', metavar='FILE',
+                            help='Read the entries from an LDIF file or ldapsearch output instead of LDAP')
+        parser.add_argument('--sweep', action='store_true',
+                            help='After all groups were read successfully, report teams whose group is no longer in '
+                                 'LDAP. With --ldif only if FILE is a complete export of the group OU')
 
-    def handle(self, *args, dry_run, **options):
+    def handle(self, *args, dry_run, plan_file, batch_size, page_size, jobs, incremental, ldif_file, sweep,
+               verbosity, **options):
+        dry_run = dry_run or plan_file is not None
         if dry_run:
             print('DRY RUN')
-        conn = settings.LDAP_CONNECTION
-        conn.bind()
-
-        conn.search(
-            search_base=f'{settings.LDAP_GROUP_OU},{settings.LDAP_BASE_DN}',
-            search_filter=f'(objectClass={settings.LDAP_GROUP_OBJECT_CLASS})',
-            search_scope=SUBTREE,
-            attributes=[
-                LDAP_GROUP_PK,
-                LDAP_GROUP_MEMBER_KEY,
-                LDAP_GROUP_MANAGER_KEY
-            ],
-        )
+        if jobs > 1 and connection.vendor == 'sqlite':
+            print('Ignoring --jobs, SQLite imports one batch at a time')
 
-        entries = conn.entries
-        print(f"Found {len(entries)} group entries in LDAP.")
+        search_base = f'{settings.LDAP_GROUP_OU},{settings.LDAP_BASE_DN}'
+        watermark = SyncWatermark.load(SyncWatermark.GROUPS)
+        with ExitStack() as stack:
+            if ldif_file is not None:
+                # Not related to the watermark of the directory, and only complete if the caller says so
+                full_sweep = sweep
+                print(f'Reading entries from {ldif_file}')
+                source = search_ldif(stack.enter_context(open(ldif_file, encoding='utf-8')), search_base,
+                                     settings.LDAP_GROUP_OBJECT_CLASS)
+            else:
+                full_read = not incremental or watermark.full_sync_due
+                full_sweep = sweep and full_read
+                if sweep and not full_read:
+                    print('Not sweeping, only modified entries are read')
+                source = self.search(search_base, watermark, full_read, incremental, page_size)
 
-        for entry in entries:
-            attrs = entry.entry_attributes_as_dict
+            result = GroupImporter(batch_size).run(watermark.observe(source), dry_run=dry_run, full_sweep=full_sweep,
+                                                   jobs=jobs)
 
-            group_name = attrs.get(LDAP_GROUP_PK, [])[0]
-            members = attrs.get(LDAP_GROUP_MEMBER_KEY, [])
-            owners = attrs.get(LDAP_GROUP_MANAGER_KEY, [])
+        if verbosity > 1:
+            for group_name in result.created:
+                print(f'{"Would create" if dry_run else "Created"} team: {group_name}')
+        for group_name, dn in result.unresolved:
+            print(f'Unknown user in group {group_name}: {dn}')
+        for group_name, dn in result.non_member_admins:
+            print(f'Owner of group {group_name} is no member, not made admin: {dn}')
 
-            print(_('Handling group %(group)s') % {
-                'group': group_name
-            })
+        for name in result.missing:
+            print(f'Group no longer in LDAP: {name}')
 
-            if not dry_run:
-                team, created = Team.objects.get_or_create(ldap_name=group_name)
-                if created:
-                    team.slug = group_name
-                    team.name = group_name
-                    team.save()
-                    print(_('Created team'))
-            else:
-                team = Team.objects.filter(ldap_name=group_name).first()
-                if team is None:
-                    print(_('Team not existing, would create'))
+        if plan_file is not None:
+            with open(plan_file, 'w') as fp:
+                result.plan.dump(fp)
+            print(f'Wrote plan to {plan_file}: {result.plan}')
+        elif dry_run:
+            print(f'Plan: {result.plan}')
+        elif ldif_file is None:
+            watermark.advance(full_read)
 
-            print(_('Syncing'))
+        print(f"Import complete: {result}")
 
-            ldap_group_members = [User.objects.get(username=member.split(',')[0].split('=')[1]) for member in members if LDAP_USER_PK in member]
-            ldap_group_owners = [User.objects.get(username=owner.split(',')[0].split('=')[1]) for owner in owners if LDAP_USER_PK in owner]
-            if not dry_run:
-                team.members.set(ldap_group_members)
-                team.admins.set(ldap_group_owners)
-                team.save()
+    @staticmethod
+    def search(search_base, watermark, full_read, incremental, page_size):
+        search_filter = f'(objectClass={settings.LDAP_GROUP_OBJECT_CLASS})'
+        if not full_read:
+            search_filter = watermark.search_filter(search_filter)
+            print(f'Reading entries modified since {watermark.modified_at}')
+        elif incremental:
+            print('Full read is due')
 
-            print(f'Add {len(ldap_group_members)} members to team: {team}')
-            print(f'Added {len(ldap_group_owners)} managers to team: {team}')
+        # The next page is fetched while the current one is written
+        pages = prefetch(paged_search(
+            search_base=search_base,
+            search_filter=search_filter,
+            attributes=[
+                LDAP_GROUP_PK,
+                LDAP_GROUP_MEMBER_KEY,
+                LDAP_GROUP_MANAGER_KEY,
+                MODIFY_TIMESTAMP,
+            ],
+            page_size=page_size,
+        ))
 
-        conn.unbind()
-        print("Import complete.")
\ No newline at end of file
+        for dn, attrs in entries(pages):
+            if attrs.get(LDAP_GROUP_PK):
+                group_dn_cache.set(attrs[LDAP_GROUP_PK][0], dn)
+            yield dn, attrs
@@ -1,8 +1,13 @@
+from contextlib import ExitStack
+
 from django.conf import settings
 from django.core.management import BaseCommand
-from ldap3 import SUBTREE
 
-from gpnmgr.accounts.models import User
+from gpnmgr.ldap.importers import UserImporter
+from gpnmgr.ldap.ldif import search_ldif
+from gpnmgr.ldap.models import SyncWatermark
+from gpnmgr.ldap.models.watermark import MODIFY_TIMESTAMP
+from gpnmgr.ldap.search import entries, paged_search, prefetch
 from gpnmgr.settings import LDAP_USER_PK
 
 
@@ -11,63 +16,84 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--dry-run', action='store_true', help='Don\'t write any changes')
+        parser.add_argument('--plan', dest='plan_file', metavar='FILE',
+                            help='Write the changes as JSON plan to FILE instead of applying them, see ldap_apply_plan')
+        parser.add_argument('--batch-size', type=int, default=settings.LDAP_IMPORT_BATCH_SIZE,
+                            help='Number of users per bulk insert or update')
+        parser.add_argument('--page-size', type=int, default=settings.LDAP_SEARCH_PAGE_SIZE,
+                            help='Number of entries per LDAP search page')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only read entries modified since the last run, unless a full read is due')
+        parser.add_argument('--ldif', dest='ldif_file', metavar='FILE',
+                            help='Read the entries from an LDIF file or ldapsearch output instead of LDAP')
+        parser.add_argument('--sweep', action='store_true',
+                            help='After all users were read successfully, clear the DN of users no longer in LDAP. '
+                                 'With --ldif only if FILE is a complete export of the user OU')
 
-    def handle(self, *args, dry_run, **options):
+    def handle(self, *args, dry_run, plan_file, batch_size, page_size, incremental, ldif_file, sweep,
+               verbosity, **options):
+        dry_run = dry_run or plan_file is not None
         if dry_run:
             print('DRY RUN')
 
-        conn = settings.LDAP_CONNECTION
-        conn.bind()
-
-        conn.search(
-            search_base=f'{settings.LDAP_USER_OU},{settings.LDAP_BASE_DN}',
-            search_filter=f'(objectClass={settings.LDAP_USER_OBJECT_CLASS})',
-            search_scope=SUBTREE,
-            attributes=[
-                'sn',
-                LDAP_USER_PK,
-            ],
-        )
+        search_base = f'{settings.LDAP_USER_OU},{settings.LDAP_BASE_DN}'
+        watermark = SyncWatermark.load(SyncWatermark.USERS)
+        with ExitStack() as stack:
+            if ldif_file is not None:
+                # Not related to the watermark of the directory, and only complete if the caller says so
+                full_sweep = sweep
+                print(f'Reading entries from {ldif_file}')
+                source = search_ldif(stack.enter_context(open(ldif_file, encoding='utf-8')), search_base,
+                                     settings.LDAP_USER_OBJECT_CLASS)
+            else:
+                full_read = not incremental or watermark.full_sync_due
+                full_sweep = sweep and full_read
+                if sweep and not full_read:
+                    print('Not sweeping, only modified entries are read')
+                source = self.search(search_base, watermark, full_read, incremental, page_size)
 
-        entries = conn.entries
-        print(f'Found {len(entries)} users entries in LDAP.')
+            result = UserImporter(batch_size).run(watermark.observe(source), dry_run=dry_run, full_sweep=full_sweep)
 
-        for entry in entries:
-            attrs = entry.entry_attributes_as_dict
+        if verbosity > 1:
+            for dn in result.skipped:
+                print(f'Skipping entry without {LDAP_USER_PK}: {dn}')
+            for username in result.created:
+                print(f'{"Would create" if dry_run else "Created new"} user: {username}')
+            for username in result.updated:
+                print(f'{"Would sync" if dry_run else "Synced"} attributes of user: {username}')
 
-            username = attrs.get(LDAP_USER_PK, [None])[0]
-            last_name = attrs.get('sn', [None])[0]
-            object_dn = entry.entry_dn
+        for name in result.missing:
+            print(f'User no longer in LDAP: {name}')
 
-            if not username:
-                print(f'Skipping entry without {LDAP_USER_PK}: {entry.entry_dn}')
-                continue
+        if plan_file is not None:
+            with open(plan_file, 'w') as fp:
+                result.plan.dump(fp)
+            print(f'Wrote plan to {plan_file}: {result.plan}')
+        elif dry_run:
+            print(f'Plan: {result.plan}')
+        elif ldif_file is None:
+            watermark.advance(full_read)
 
-            if dry_run:
-                if User.objects.filter(username=username).count() > 0:
-                    print(f'User already exists: {username}')
-                else:
-                    print(f'Would create user: {username}')
-            else:
-                user, created = User.objects.get_or_create(
-                    username=username,
-                    defaults={
-                        'last_name': last_name or '',
-                        'display_name': last_name or None,
-                        'object_dn': object_dn,
-                    },
-                )
+        print(f'Import complete: {result}')
 
-                if created:
-                    user.set_unusable_password()
-                    user.save()
-                    print(f'Created new user: {username}')
-                else:
-                    user.last_name = last_name or ''
-                    user.display_name = last_name or ''
-                    user.object_dn = object_dn
-                    user.save()
-                    print(f'User already exists: {username}. Synced attributes')
+    @staticmethod
+    def search(search_base, watermark, full_read, incremental, page_size):
+        search_filter = f'(objectClass={settings.LDAP_USER_OBJECT_CLASS})'
+        if not full_read:
+            search_filter = watermark.search_filter(search_filter)
+            print(f'Reading entries modified since {watermark.modified_at}')
+        elif incremental:
+            print('Full read is due')
 
-        conn.unbind()
-        print('Import complete.')
\ No newline at end of file
+        # The next page is fetched while the current one is written
+        pages = prefetch(paged_search(
+            search_base=search_base,
+            search_filter=search_filter,
+            attributes=[
+                'sn',
+                LDAP_USER_PK,
+                MODIFY_TIMESTAMP,
+            ],
+            page_size=page_size,
+        ))
+        return entries(pages)
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 11:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("teams", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="team",
+            index=models.Index(fields=["name", "id"], name="teams_team_name_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="team",
+            index=models.Index(
+                fields=["cost_center", "id"], name="teams_team_cost_center_id_idx"
+            ),
+        ),
+    ]
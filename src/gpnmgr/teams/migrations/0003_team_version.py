@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("teams", "0002_team_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="team",
+            name="version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
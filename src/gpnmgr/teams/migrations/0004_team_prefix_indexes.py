@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-18 14:40
+
+from django.db import migrations
+
+# The istartswith filters of the team search compile to different SQL per database, and the index matching them can't
+# be declared in Meta.indexes on both
+PREFIX_FIELDS = ['slug', 'name', 'cost_center', 'ldap_name']
+CREATE_INDEX = {
+    # LIKE, which SQLite only serves from an index with the NOCASE collation
+    'sqlite': 'CREATE INDEX {index} ON teams_team ({field} COLLATE NOCASE)',
+    # UPPER(field::text) LIKE UPPER(%s), which needs the expression with the pattern operator class
+    'postgresql': 'CREATE INDEX {index} ON teams_team ((UPPER({field}::text)) text_pattern_ops)',
+}
+
+
+def index_name(field):
+    return f'teams_team_{field}_prefix_idx'
+
+
+def create_prefix_indexes(apps, schema_editor):
+    sql = CREATE_INDEX.get(schema_editor.connection.vendor)
+    if sql is None:
+        return
+    for field in PREFIX_FIELDS:
+        schema_editor.execute(sql.format(index=schema_editor.quote_name(index_name(field)),
+                                         field=schema_editor.quote_name(field)))
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in CREATE_INDEX:
+        return
+    for field in PREFIX_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(index_name(field))}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("teams", "0003_team_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
@@ -1,5 +1,5 @@
 from auditlog.registry import auditlog
 
-from .team import Team
+from .team import Team, TeamRoster
 
 auditlog.register(Team, m2m_fields={'admins','members'})
\ No newline at end of file
@@ -1,13 +1,40 @@
 from __future__ import annotations
 
 import uuid
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Optional, TypeAlias, TypedDict
 
-from django.conf import settings
+from django.contrib.auth.models import AbstractBaseUser, AnonymousUser
 from django.db import models
-from django.db.models import QuerySet
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Q, QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 
 from gpnmgr.accounts.models import User
+from gpnmgr.ldap.models import SyncStatus
+
+if TYPE_CHECKING:
+    from django_stubs_ext import WithAnnotations
+
+
+def valid_count(field_name: str) -> Coalesce:
+    # A correlated subquery per relation, joining both relations would multiply the rows of members and admins
+    through = getattr(Team, field_name).through
+    counts = (through.objects.filter(team=OuterRef('pk'), user__is_placeholder=False)
+              .order_by().values('team').annotate(count=Count('*')).values('count'))
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class TeamQuerySet(models.QuerySet):
+    def with_counts(self) -> TeamQuerySet:
+        """
+        Annotates the number of members and admins that are not placeholder, as `valid_member_count` and
+        `valid_admin_count`
+        """
+        return self.annotate(valid_member_count=valid_count('members'), valid_admin_count=valid_count('admins'))
+
+    def bump_version(self) -> int:
+        return self.update(version=F('version') + 1)
 
 
 class Team(models.Model):
@@ -26,9 +53,23 @@ class Team(models.Model):
     admins = models.ManyToManyField(User, verbose_name=_("Administrators"), default=None)
     members = models.ManyToManyField(User, verbose_name=_("Members"), related_name='teams', default=None)
 
+    # Increased on every change of the team, its memberships or its members, see gpnmgr.teams.fragments
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = TeamQuerySet.as_manager()
+
+    # Only set on teams loaded with TeamQuerySet.with_counts()
+    valid_member_count: int
+    valid_admin_count: int
 
     class Meta:
         ordering = ["slug"]
+        # Back sorting and keyset pagination of the team search, slug and ldap_name are covered by their unique indexes.
+        # The indexes for its prefix filters depend on the database and are created by migration 0004
+        indexes = [
+            models.Index(fields=['name', 'id'], name='teams_team_name_id_idx'),
+            models.Index(fields=['cost_center', 'id'], name='teams_team_cost_center_id_idx'),
+        ]
         verbose_name = _("Team")
         verbose_name_plural = _("Teams")
         default_permissions = ()
@@ -39,15 +80,24 @@ class Team(models.Model):
     def __str__(self) -> str:
         return f'{self.name} ({self.slug})'
 
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        # The version is only increased in the database, writing back the loaded one could undo a concurrent increase
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [name for name in update_fields if name != 'version']
+        super().save(*args, **kwargs)
+
     @property
     def valid_members(self) -> QuerySet:
         # Members that are not placeholder
-        return self.members.exclude(object_dn=settings.LDAP_PLACEHOLDER_DN)
+        return self.members.filter(is_placeholder=False)
 
     @property
     def valid_admins(self) -> QuerySet:
         # Admins that are not placeholder
-        return self.admins.exclude(object_dn=settings.LDAP_PLACEHOLDER_DN)
+        return self.admins.filter(is_placeholder=False)
 
     @property
     def non_admins(self) -> QuerySet:
@@ -59,4 +109,80 @@ class Team(models.Model):
 
     @property
     def admin_count(self) -> int:
-        return self.valid_admins.count()
\ No newline at end of file
+        return self.valid_admins.count()
+
+    @property
+    def ldap_sync_status(self) -> SyncStatus:
+        return self.ldap_outbox.status()
+
+    def is_admin(self, user: AbstractBaseUser | AnonymousUser) -> bool:
+        return user.pk is not None and self.admins.filter(pk=user.pk).exists()
+
+
+class RosterAnnotations(TypedDict):
+    is_team_admin: bool
+
+
+# A member loaded by TeamRoster
+RosterMember: TypeAlias = 'WithAnnotations[User, RosterAnnotations]'
+
+
+class TeamRoster:
+    """
+    A page of the members of a team, loaded with their admin flag in one query and split in memory.
+
+    Admins come first, then the other members, each ordered by username. Placeholders are left out, `query` filters
+    by name and `after` continues after the last member of the previous page, its `next`. Admins are always members,
+    both the views and the LDAP import only make members admins. Nothing is loaded before the page is used, so a
+    cached rendering costs no query.
+    """
+
+    def __init__(self, team: Team, query: str = '', after: Optional[str] = None, limit: Optional[int] = None) -> None:
+        self.team = team
+        self.query = query
+        self.after = after or None
+        self.limit = limit
+        self.first = self.after is None
+
+    @cached_property
+    def page(self) -> list[RosterMember]:
+        is_admin = Exists(Team.admins.through.objects.filter(team=self.team, user=OuterRef('pk')))
+        members = self.team.members.filter(is_placeholder=False).annotate(is_team_admin=is_admin)
+        if self.query:
+            members = members.filter(Q(username__icontains=self.query) | Q(display_name__icontains=self.query))
+        if self.after:
+            flag, _, username = self.after.partition(':')
+            if flag == '1':
+                members = members.filter(Q(is_team_admin=True, username__gt=username) | Q(is_team_admin=False))
+            else:
+                members = members.filter(is_team_admin=False, username__gt=username)
+        members = members.order_by('-is_team_admin', 'username')
+        # One more than the page, to know whether there is a next one
+        return list(members if self.limit is None else members[:self.limit + 1])
+
+    @property
+    def members(self) -> list[RosterMember]:
+        return self.page if self.limit is None else self.page[:self.limit]
+
+    @property
+    def next(self) -> Optional[str]:
+        if self.limit is None or len(self.page) <= self.limit:
+            return None
+        last = self.members[-1]
+        return f'{int(last.is_team_admin)}:{last.username}'
+
+    @property
+    def admins(self) -> list[RosterMember]:
+        return [member for member in self.members if member.is_team_admin]
+
+    @property
+    def non_admins(self) -> list[RosterMember]:
+        return [member for member in self.members if not member.is_team_admin]
+
+    @property
+    def members_start(self) -> bool:
+        """
+        Whether the heading of the non-admins, which only separates them from admins, belongs on this page
+        """
+        continued = self.after is not None and not self.after.startswith('1:')
+        return bool(self.non_admins) and not continued and (bool(self.admins) or not self.first)
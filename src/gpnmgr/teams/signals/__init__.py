@@ -1 +1,2 @@
-from .team import ensure_admin_is_member, sync_admin_change_to_ldap, sync_member_change_to_ldap
\ No newline at end of file
+from .team import ensure_admin_is_member, sync_admin_change_to_ldap, sync_member_change_to_ldap, bump_version_on_save, \
+    bump_version_on_membership_change, bump_version_on_user_change
\ No newline at end of file
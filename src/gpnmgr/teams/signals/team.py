@@ -1,14 +1,30 @@
-from django.conf import settings
+import logging
+
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
-from ldap3 import SUBTREE, MODIFY_ADD, MODIFY_DELETE
 
 from ..models import Team
 from ...accounts.models import User
+from ...ldap import sync_suspended
+from ...ldap.outbox import enqueue
 from ...settings import LDAP_GROUP_MEMBER_KEY, LDAP_GROUP_MANAGER_KEY, LDAP_PLACEHOLDER_DN, LDAP_GROUP_MEMBER_REQUIRED
 
+logger = logging.getLogger(__name__)
+
+
+def object_dns(team: Team, pk_set: set[int]) -> list[str]:
+    """
+    The DNs of the given users. Users without one are not in LDAP and are left out of the group's modification.
+    """
+    user_dns = []
+    for username, object_dn in User.objects.filter(pk__in=pk_set).distinct().values_list('username', 'object_dn'):
+        if object_dn:
+            user_dns.append(object_dn)
+        else:
+            logger.warning('Not syncing the membership of %s in %s to LDAP, the user has no DN', username, team)
+    return user_dns
+
 
 @receiver(m2m_changed, sender=Team.admins.through)
 def ensure_admin_is_member(sender, instance, action, pk_set, **kwargs):
@@ -25,81 +41,84 @@ def ensure_admin_is_member(sender, instance, action, pk_set, **kwargs):
 @receiver(m2m_changed, sender=Team.members.through)
 def sync_member_change_to_ldap(sender, instance, action, pk_set, **kwargs):
     """
-    Sync member changes to LDAP
+    Queue member changes for LDAP
     """
-    conn = settings.LDAP_CONNECTION
-    conn.bind()
-    conn.search(
-        search_base=f'{settings.LDAP_GROUP_OU},{settings.LDAP_BASE_DN}',
-        search_filter=f'(&(objectClass={settings.LDAP_GROUP_OBJECT_CLASS})(cn={instance.ldap_name}))',
-        search_scope=SUBTREE,
-        attributes=[
-            LDAP_GROUP_MEMBER_KEY
-        ],
-    )
+    if action not in ("post_add", "post_remove") or sync_suspended():
+        return
 
-    group_entries = conn.entries
-
-    if len(group_entries) == 0:
-        raise IntegrityError(
-            f'There is no group found in LDAP with the name {instance.ldap_name}'
-        )
-
-    group_dn = group_entries[0].entry_dn
-
-    user_dns = list(User.objects.filter(pk__in=pk_set).distinct().values_list('object_dn', flat=True))
+    user_dns = object_dns(instance, pk_set)
 
     if action == "post_add":
-        conn.modify(group_dn, {
-            LDAP_GROUP_MEMBER_KEY: [(MODIFY_ADD, user_dns)]
-        })
-
+        # The placeholder added below is already part of the entry
+        if not getattr(instance, '_adding_placeholder', False):
+            enqueue(instance, LDAP_GROUP_MEMBER_KEY, add=user_dns)
 
     if action == "post_remove":
-        if instance.valid_members.count() == 0 and LDAP_GROUP_MEMBER_REQUIRED:
-            instance.members.add(User.objects.get(object_dn=LDAP_PLACEHOLDER_DN))
-            conn.bind()
-        conn.modify(group_dn, {
-            LDAP_GROUP_MEMBER_KEY: [(MODIFY_DELETE, user_dns)]
-        })
-
-    conn.unbind()
+        placeholder_dns = []
+        placeholder_pk = None
+        if LDAP_GROUP_MEMBER_REQUIRED and not instance.valid_members.exists():
+            placeholder_pk = User.placeholder_pk()
+        if placeholder_pk is not None:
+            # Keep the group from becoming empty within the same modify. Added through the manager, so the audit log
+            # records it like any other membership change
+            instance._adding_placeholder = True
+            try:
+                instance.members.add(placeholder_pk)
+            finally:
+                del instance._adding_placeholder
+            placeholder_dns.append(LDAP_PLACEHOLDER_DN)
+        enqueue(instance, LDAP_GROUP_MEMBER_KEY, add=placeholder_dns, delete=user_dns)
 
 @receiver(m2m_changed, sender=Team.admins.through)
 def sync_admin_change_to_ldap(sender, instance, action, pk_set, **kwargs):
     """
-    Sync admin changes to LDAP
+    Queue admin changes for LDAP
     """
-    conn = settings.LDAP_CONNECTION
-    conn.bind()
-    conn.search(
-        search_base=f'{settings.LDAP_GROUP_OU},{settings.LDAP_BASE_DN}',
-        search_filter=f'(&(objectClass={settings.LDAP_GROUP_OBJECT_CLASS})(cn={instance.ldap_name}))',
-        search_scope=SUBTREE,
-        attributes=[
-            LDAP_GROUP_MANAGER_KEY
-        ],
-    )
-
-    group_entries = conn.entries
+    if action not in ("post_add", "post_remove") or sync_suspended():
+        return
 
-    if len(group_entries) == 0:
-        raise IntegrityError(
-            f'There is no group found in LDAP with the name {instance.ldap_name}'
-        )
-
-    group_dn = group_entries[0].entry_dn
-
-    user_dns = list(User.objects.filter(pk__in=pk_set).distinct().values_list('object_dn', flat=True))
+    user_dns = object_dns(instance, pk_set)
 
     if action == "post_add":
-        conn.modify(group_dn, {
-            LDAP_GROUP_MANAGER_KEY: [(MODIFY_ADD, user_dns)]
-        })
+        enqueue(instance, LDAP_GROUP_MANAGER_KEY, add=user_dns)
 
     if action == "post_remove":
-        conn.modify(group_dn, {
-            LDAP_GROUP_MANAGER_KEY: [(MODIFY_DELETE, user_dns)]
-        })
+        enqueue(instance, LDAP_GROUP_MANAGER_KEY, delete=user_dns)
+
+
+@receiver(post_save, sender=Team)
+def bump_version_on_save(sender, instance, created, **kwargs):
+    """
+    Invalidate the cached fragments of a changed team
+    """
+    if created:
+        return
+    # Team.save() never writes the version, so this increase is not undone by a save with a stale instance
+    Team.objects.filter(pk=instance.pk).bump_version()
+    instance.refresh_from_db(fields=['version'])
 
-    conn.unbind()
\ No newline at end of file
+@receiver(m2m_changed, sender=Team.members.through)
+@receiver(m2m_changed, sender=Team.admins.through)
+def bump_version_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate the cached fragments of teams whose members or admins changed, also when changed from the user's side
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            Team.objects.filter(pk=instance.pk).bump_version()
+    elif action in ("post_add", "post_remove"):
+        Team.objects.filter(pk__in=pk_set).bump_version()
+    elif action == "pre_clear":
+        # Bumped after the change, so no fragment of the old state can be cached under the new version
+        instance._cleared_team_ids = list(sender.objects.filter(user=instance).values_list('team_id', flat=True))
+    elif action == "post_clear":
+        Team.objects.filter(pk__in=instance.__dict__.pop('_cleared_team_ids', [])).bump_version()
+
+@receiver(post_save, sender=User)
+def bump_version_on_user_change(sender, instance, created, update_fields, **kwargs):
+    """
+    Invalidate the cached fragments of the teams a user is shown in, unless only the last login changed
+    """
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    Team.objects.filter(members=instance).bump_version()
@@ -0,0 +1,282 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import translation
+
+from gpnmgr.accounts.models import User
+from gpnmgr.ldap.importers.plan import Plan, UserRecord
+from gpnmgr.teams.fragments import MANAGER, MEMBER, fragment_key
+from gpnmgr.teams.models import Team, TeamRoster
+from gpnmgr.teams.views.search import encode_cursor
+
+
+class TeamListViewTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='alice')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def create_team(self, slug, members=0, admins=0):
+        team = Team.objects.create(name=slug, slug=slug)
+        users = [User.objects.create(username=f'{slug}-{i}') for i in range(members)]
+        team.members.add(*users, User.objects.create(username=f'{slug}-placeholder', is_placeholder=True))
+        team.admins.add(*users[:admins])
+        return team
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('teams_list'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def testCounts(self):
+        self.create_team('kueche', members=3, admins=1)
+        self.create_team('orga')
+        teams = Team.objects.with_counts()
+        self.assertEqual([(team.valid_member_count, team.valid_admin_count) for team in teams], [(3, 1), (0, 0)])
+        self.assertEqual([(team.member_count, team.admin_count) for team in teams], [(3, 1), (0, 0)])
+
+    def testConstantQueries(self):
+        self.create_team('kueche', members=2, admins=1)
+        _, expected = self.list_queries()
+
+        for i in range(5):
+            self.create_team(f'team{i}', members=2, admins=2)
+        response, queries = self.list_queries()
+        self.assertEqual(queries, expected)
+        self.assertContains(response, '<td>2</td>', count=11)
+
+    @override_settings(TEAMS_PAGE_SIZE=2)
+    def testPagination(self):
+        for i in range(5):
+            Team.objects.create(name=f'team{i}', slug=f'team{i}')
+        response = self.client.get(reverse('teams_list'), {'page': 3})
+        self.assertEqual([team.slug for team in response.context['object_list']], ['team4'])
+
+
+class TeamSearchViewTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='alice')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        for i, (slug, cost_center) in enumerate([('kueche', '100'), ('orga', None), ('infodesk', '200'),
+                                                 ('kasse', None), ('technik', '100')]):
+            team = Team.objects.create(name=slug.title(), slug=slug, cost_center=cost_center,
+                                       ldap_name=f'gpn-{slug}')
+            team.members.add(*users[:i % 4])
+
+    def search(self, **params):
+        response = self.client.get(reverse('teams_search'), params)
+        return response.json()
+
+    def walk(self, **params):
+        slugs = []
+        data = self.search(**params)
+        while True:
+            slugs.extend(team['slug'] for team in data['results'])
+            if data['next'] is None:
+                return slugs
+            data = self.search(**params, cursor=data['next'])
+
+    def testFilter(self):
+        self.assertEqual([team['slug'] for team in self.search(q='KA')['results']], ['kasse'])
+        self.assertEqual([team['slug'] for team in self.search(q='gpn-o')['results']], ['orga'])
+        self.assertEqual(self.search(q='sse')['results'], [])
+        self.assertEqual([team['slug'] for team in self.search(cost_center='1')['results']], ['kueche', 'technik'])
+        self.assertEqual([team['slug'] for team in self.search(ldap_name='gpn-k')['results']], ['kasse', 'kueche'])
+        team = self.search(slug='orga')['results'][0]
+        self.assertEqual((team['member_count'], team['edit_url']), (1, None))
+
+    @staticmethod
+    def by_id(*slugs, descending=False):
+        # Ties are ordered by id
+        return sorted(slugs, key=lambda slug: str(Team.objects.get(slug=slug).pk), reverse=descending)
+
+    @override_settings(TEAMS_PAGE_SIZE=2)
+    def testKeysetPagination(self):
+        self.assertEqual(self.walk(), ['infodesk', 'kasse', 'kueche', 'orga', 'technik'])
+        self.assertEqual(self.walk(sort='-name'), ['technik', 'orga', 'kueche', 'kasse', 'infodesk'])
+        # NULL sorts last ascending and first descending
+        self.assertEqual(self.walk(sort='cost_center'),
+                         [*self.by_id('kueche', 'technik'), 'infodesk', *self.by_id('orga', 'kasse')])
+        self.assertEqual(self.walk(sort='-cost_center'), [
+            *self.by_id('orga', 'kasse', descending=True), 'infodesk',
+            *self.by_id('kueche', 'technik', descending=True),
+        ])
+        self.assertEqual(self.walk(sort='-members', q='gpn-'),
+                         ['kasse', 'infodesk', 'orga', *self.by_id('kueche', 'technik', descending=True)])
+
+    def testInvalid(self):
+        response = self.client.get(reverse('teams_search'), {'sort': 'primary_contact'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('teams_search'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        for value, pk in (('kueche', 'no uuid'), (['kueche'], str(Team.objects.first().pk)),
+                          (3, str(Team.objects.first().pk)), ('kueche', 3)):
+            response = self.client.get(reverse('teams_search'), {'cursor': encode_cursor(value, pk)})
+            self.assertEqual(response.status_code, 400)
+
+    def testPrefixFiltersUseIndex(self):
+        for field in ('slug', 'name', 'cost_center', 'ldap_name'):
+            plan = Team.objects.filter(**{f'{field}__istartswith': 'k'}).explain()
+            self.assertIn(f'teams_team_{field}_prefix_idx', plan)
+
+
+class TeamDetailViewTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='alice', display_name='Alice')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        self.placeholder = User.objects.create(username='placeholder', is_placeholder=True)
+        self.team.members.add(self.user, self.placeholder)
+        self.team.admins.add(self.user)
+
+    def detail_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('team_detail', args=[self.team.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def testRoster(self):
+        bob = User.objects.create(username='bob')
+        self.team.members.add(bob)
+        roster = TeamRoster(self.team)
+        self.assertEqual(roster.admins, [self.user])
+        self.assertEqual(roster.non_admins, [bob])
+        self.assertTrue(roster.members_start)
+        self.assertTrue(self.team.is_admin(self.user))
+        self.assertFalse(self.team.is_admin(bob))
+
+    @override_settings(TEAM_MEMBERS_PAGE_SIZE=3)
+    def testMemberPages(self):
+        users = [User.objects.create(username=f'user{i}', display_name=f'User {i}') for i in range(5)]
+        self.team.members.add(*users)
+        self.team.admins.add(*users[3:])
+
+        pages = []
+        params = {}
+        while True:
+            data = self.client.get(reverse('team_members', args=[self.team.pk]), params).json()
+            pages.append(data['html'])
+            if data['next'] is None:
+                break
+            params = {'after': data['next']}
+        # Admins first, the headings only where their section starts
+        self.assertEqual([[name for name in ['Alice', 'user0', 'user1', 'user2', 'user3', 'user4', 'Admins', 'Members']
+                           if name in html] for html in pages],
+                         [['Alice', 'user3', 'user4', 'Admins'], ['user0', 'user1', 'user2', 'Members']])
+
+        html = self.client.get(reverse('team_members', args=[self.team.pk]), {'q': 'user 1'}).json()['html']
+        self.assertIn('user1', html)
+        self.assertNotIn('user0', html)
+        self.assertNotIn('Admins', html)
+
+    def testConstantQueries(self):
+        response, expected = self.detail_queries()
+        self.assertTrue(response.context['is_team_admin'])
+
+        users = [User.objects.create(username=f'user{i}') for i in range(10)]
+        self.team.members.add(*users)
+        self.team.admins.add(*users[:3])
+        response, queries = self.detail_queries()
+        self.assertEqual(queries, expected)
+        self.assertEqual(len(response.context['roster'].admins), 4)
+        self.assertIsNone(response.context['roster'].next)
+        # A team admin without manage_teams may only remove non-admins
+        self.assertContains(response, 'data-bs-target="#confirmMemberModal"', count=7)
+        self.assertContains(response, 'id="confirmMemberModal"', count=1)
+
+
+class TeamVersionTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username='alice', display_name='Alice')
+        self.team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+
+    def assertBumped(self, times=1):
+        version = self.team.version
+        self.team.refresh_from_db(fields=['version'])
+        self.assertEqual(self.team.version, version + times)
+
+    def testBumps(self):
+        self.team.name = 'Kitchen'
+        self.team.save()
+        self.assertEqual(self.team.version, 1)
+        self.assertBumped(0)
+
+        # Bob stays, so removing Alice needs no placeholder
+        self.team.members.add(self.alice, User.objects.create(username='bob'))
+        self.assertBumped()
+        self.team.admins.add(self.alice)
+        self.assertBumped()
+        self.alice.display_name = 'Alice A.'
+        self.alice.save()
+        self.assertBumped()
+        self.alice.save(update_fields=['last_login'])
+        self.assertBumped(0)
+        self.alice.team_set.clear()
+        self.assertBumped()
+        self.team.members.remove(self.alice)
+        self.assertBumped()
+
+    def testSaveOfStaleInstanceKeepsVersion(self):
+        stale = Team.objects.get(pk=self.team.pk)
+        self.team.members.add(self.alice)
+        stale.name = 'Kitchen'
+        stale.save()
+        self.assertEqual(stale.version, 2)
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.name, self.team.version), ('Kitchen', 2))
+
+    def testPlan(self):
+        self.team.members.add(self.alice)
+        self.team.refresh_from_db(fields=['version'])
+        Plan(update_users={'alice': UserRecord('', 'Alice B.', None, False)}).apply()
+        self.assertBumped()
+        Plan(teams={'kueche': {'members': {'add': [], 'remove': ['alice']}}}).apply()
+        self.assertBumped()
+
+
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='alice', display_name='Alice')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.team = Team.objects.create(name='Küche', slug='kueche', ldap_name='kueche')
+        self.team.members.add(self.user)
+
+    def detail(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('team_detail', args=[self.team.pk]))
+        return response, len(queries)
+
+    def testDetail(self):
+        _, uncached = self.detail()
+        response, cached = self.detail()
+        # The roster is not loaded
+        self.assertEqual(cached, uncached - 1)
+        self.assertContains(response, 'Alice')
+
+        bob = User.objects.create(username='bob', display_name='Bob')
+        self.team.members.add(bob)
+        response, queries = self.detail()
+        self.assertEqual(queries, uncached)
+        self.assertContains(response, 'Bob')
+
+        with translation.override('de'):
+            key = fragment_key('roster', self.team, MEMBER)
+        self.assertNotEqual(key, fragment_key('roster', self.team, MEMBER))
+
+    def testTiers(self):
+        self.client.get(reverse('teams_list'))
+        self.team.refresh_from_db()
+        key = fragment_key('row', self.team, MEMBER)
+        row = caches[settings.TEAMS_FRAGMENT_CACHE].get(key)
+        self.assertIn('kueche', row)
+        self.assertNotIn('team-modify-button', row)
+        self.assertIsNone(caches[settings.TEAMS_FRAGMENT_CACHE].get(fragment_key('row', self.team, MANAGER)))
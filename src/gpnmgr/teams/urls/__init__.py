@@ -3,14 +3,17 @@ from typing import Any, List
 from django.urls import path
 
 from gpnmgr.teams.views.teams import TeamListView, TeamDetailView, TeamModifyView, TeamCreateView, TeamMemberAddView, \
-    TeamMemberRemoveView, TeamMemberPromoteView, TeamMemberDemoteView
+    TeamMemberRemoveView, TeamMemberPromoteView, TeamMemberDemoteView, TeamMemberListView
+from gpnmgr.teams.views.search import TeamSearchView
 
 urlpatterns: List[Any] = [
     # teams
     path('list', TeamListView.as_view(), name="teams_list"),
+    path('search', TeamSearchView.as_view(), name="teams_search"),
     path('create', TeamCreateView.as_view(), name="teams_create"),
     path('detail/<uuid:pk>', TeamDetailView.as_view(), name="team_detail"),
     path('edit/<uuid:pk>', TeamModifyView.as_view(), name="team_edit"),
+    path('members/<uuid:pk>', TeamMemberListView.as_view(), name="team_members"),
     path('member_add/<uuid:pk>', TeamMemberAddView.as_view(), name="team_member_add"),
     path('member_remove/<uuid:pk>/<str:member>', TeamMemberRemoveView.as_view(), name="team_member_remove"),
     path('member_promote/<uuid:pk>/<str:member>', TeamMemberPromoteView.as_view(), name="team_member_promote"),
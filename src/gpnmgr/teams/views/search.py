@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+import uuid
+from typing import Any, Optional
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import F, Q, QuerySet
+from django.http import HttpRequest, JsonResponse
+from django.urls import reverse
+from django.views.generic import View
+
+from ..models import Team
+
+# Query parameter -> prefix filter, backed by the prefix indexes of migration teams.0004
+FILTERS = {
+    'slug': 'slug__istartswith',
+    'name': 'name__istartswith',
+    'cost_center': 'cost_center__istartswith',
+    'ldap_name': 'ldap_name__istartswith',
+}
+
+# Sort key -> (ordered expression, nullable, type of its values). The counts are subqueries of
+# TeamQuerySet.with_counts() and have no index
+SORT_KEYS = {
+    'slug': ('slug', False, str),
+    'name': ('name', False, str),
+    'cost_center': ('cost_center', True, str),
+    'ldap_name': ('ldap_name', True, str),
+    'members': ('valid_member_count', False, int),
+    'admins': ('valid_admin_count', False, int),
+}
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(value: Any, pk: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, str(pk)]).encode()).decode()
+
+
+def decode_cursor(cursor: str, value_type: type, nullable: bool) -> tuple[Any, uuid.UUID]:
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        pk = uuid.UUID(pk)
+    except (binascii.Error, ValueError, TypeError, AttributeError) as e:
+        raise InvalidQuery('Invalid cursor') from e
+    # bool is an int to isinstance()
+    if not (value is None and nullable or isinstance(value, value_type) and not isinstance(value, bool)):
+        raise InvalidQuery('Invalid cursor')
+    return value, pk
+
+
+def after(field: str, nullable: bool, descending: bool, value: Any, pk: uuid.UUID) -> Q:
+    """
+    The rows following (value, pk) in the order of `field`, then id.
+
+    Ascending puts NULL last and descending first, which is the order a (field, id) index has when read forwards or
+    backwards.
+    """
+    if not descending:
+        if value is None:
+            return Q(**{f'{field}__isnull': True, 'id__gt': pk})
+        following = Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk})
+        return following | Q(**{f'{field}__isnull': True}) if nullable else following
+    if value is None:
+        return Q(**{f'{field}__isnull': True, 'id__lt': pk}) | Q(**{f'{field}__isnull': False})
+    return Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk})
+
+
+class TeamSearchView(LoginRequiredMixin, View):
+    """
+    Teams as JSON, filtered, sorted and paginated by keyset.
+
+    Parameters: `q` matches the start of slug, name, cost center or LDAP name, `slug`, `name`, `cost_center` and
+    `ldap_name` match the start of that column, `sort` is one of SORT_KEYS optionally prefixed with `-`, and `cursor`
+    is the `next` value of the previous page. Following pages continue after the last row instead of counting an
+    offset, so every request reads one page of rows. Only prefixes are matched, as only they can be served from an
+    index.
+
+    Sorting by `members` or `admins` is not backed by an index: the counts are computed for every matching team before
+    the page is taken, so these sorts get slower with the number of teams, while the other keys read one page.
+    """
+    http_method_names = ('get', )
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> JsonResponse:
+        try:
+            teams, next_cursor = self.page(request.GET)
+        except InvalidQuery as e:
+            return JsonResponse({'results': [], 'next': None, 'error': str(e)}, status=400)
+
+        manage_teams = request.user.has_perm('teams.manage_teams')
+        results = [{
+            'id': str(team.pk),
+            'slug': team.slug,
+            'name': team.name,
+            'cost_center': team.cost_center,
+            'primary_contact': team.primary_contact,
+            'ldap_name': team.ldap_name,
+            'member_count': team.valid_member_count,
+            'admin_count': team.valid_admin_count,
+            'detail_url': reverse('team_detail', args=[team.pk]),
+            'edit_url': reverse('team_edit', args=[team.pk]) if manage_teams else None,
+        } for team in teams]
+        return JsonResponse({'results': results, 'next': next_cursor})
+
+    @staticmethod
+    def filter(queryset: QuerySet, params) -> QuerySet:
+        query = params.get('q', '').strip()
+        if query:
+            queryset = queryset.filter(
+                Q(slug__istartswith=query) | Q(name__istartswith=query) | Q(cost_center__istartswith=query)
+                | Q(ldap_name__istartswith=query)
+            )
+        for param, lookup in FILTERS.items():
+            value = params.get(param, '').strip()
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    def page(self, params) -> tuple[list[Team], Optional[str]]:
+        sort = params.get('sort', 'slug')
+        descending = sort.startswith('-')
+        try:
+            field, nullable, value_type = SORT_KEYS[sort.removeprefix('-')]
+        except KeyError as e:
+            raise InvalidQuery(f'Invalid sort key {sort}') from e
+
+        queryset = self.filter(Team.objects.with_counts(), params)
+        if params.get('cursor'):
+            cursor = decode_cursor(params['cursor'], value_type, nullable)
+            queryset = queryset.filter(after(field, nullable, descending, *cursor))
+        if descending:
+            queryset = queryset.order_by(F(field).desc(nulls_first=True), '-id')
+        else:
+            queryset = queryset.order_by(F(field).asc(nulls_last=True), 'id')
+
+        page_size = settings.TEAMS_PAGE_SIZE
+        teams = list(queryset[:page_size + 1])
+        if len(teams) <= page_size:
+            return teams, None
+        teams = teams[:page_size]
+        return teams, encode_cursor(getattr(teams[-1], field), teams[-1].pk)
@@ -1,18 +1,23 @@
 from typing import Any, Dict
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
+from django.db import transaction
 from django.http import JsonResponse, HttpRequest, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _
 from django.views import View
 from django.views.generic import CreateView, ListView, DetailView, UpdateView
 
 from gpnmgr.accounts.models import User
+from gpnmgr.ldap import group_dn_cache
 from gpnmgr.teams.forms.add_member_form import TeamMemberAddForm
-from gpnmgr.teams.models import Team
+from gpnmgr.teams.fragments import permission_tier, render_fragment, render_fragments
+from gpnmgr.teams.models import Team, TeamRoster
 
 
 class TeamCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
@@ -85,6 +90,10 @@ class TeamModifyView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
         return super().form_invalid(form)
 
     def form_valid(self, form):
+        if 'ldap_name' in form.changed_data:
+            for ldap_name in (form.initial.get('ldap_name'), form.cleaned_data.get('ldap_name')):
+                if ldap_name:
+                    group_dn_cache.invalidate(ldap_name)
         self.object = form.save()
         if self.request.headers.get('x-requested-with') == 'XMLHttpRequest':
             return JsonResponse({'success': True})
@@ -97,6 +106,13 @@ class TeamListView(LoginRequiredMixin, ListView):
     template_name = 'teams/team_list.html'
     http_method_names = ('get', )
 
+    def get_paginate_by(self, queryset):
+        return settings.TEAMS_PAGE_SIZE
+
+    def get_queryset(self):
+        # Counting per row would cost two queries per team
+        return Team.objects.with_counts()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
@@ -107,6 +123,11 @@ class TeamListView(LoginRequiredMixin, ListView):
         form = create_view.get_form(create_view.get_form_class())
 
         context['create_form'] = form
+
+        # has_perm() queries the groups on every call
+        manage_teams = self.request.user.has_perm('teams.manage_teams')
+        context['rows'] = render_fragments('row', 'teams/team_row.html', context['object_list'],
+                                           permission_tier(manage_teams), {'manage_teams': manage_teams}, self.request)
         return context
 
 class TeamDetailView(LoginRequiredMixin, DetailView):
@@ -130,10 +151,41 @@ class TeamDetailView(LoginRequiredMixin, DetailView):
         context['modify_form'] = modify_form
         context['member_add_form'] = member_add_form
 
-        context['is_team_admin'] = self.request.user in get_object_or_404(Team, pk=self.kwargs.get('pk')).admins.all() or self.request.user.has_perm('teams.manage_teams')
+        # has_perm() queries the groups on every call, so the template reads it from the context
+        context['manage_teams'] = self.request.user.has_perm('teams.manage_teams')
+        context['is_team_admin'] = context['manage_teams'] or self.object.is_admin(self.request.user)
+
+        # The roster is only loaded if its card is not cached
+        tier = permission_tier(context['manage_teams'], context['is_team_admin'])
+        context['metadata'] = render_fragment('metadata', 'teams/team_metadata.html', self.object, tier, {},
+                                              self.request)
+        context['roster_card'] = render_fragment('roster', 'teams/team_roster.html', self.object, tier, {
+            'roster': TeamRoster(self.object, limit=settings.TEAM_MEMBERS_PAGE_SIZE),
+            'manage_teams': context['manage_teams'],
+            'is_team_admin': context['is_team_admin'],
+        }, self.request)
 
         return context
 
+class TeamMemberListView(LoginRequiredMixin, View):
+    """
+    A page of the members card of the team detail, as HTML fragment with the cursor of the next page
+    """
+    http_method_names = ('get', )
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        team = get_object_or_404(Team, pk=kwargs['pk'])
+        roster = TeamRoster(team, query=request.GET.get('q', '').strip(), after=request.GET.get('after'),
+                            limit=settings.TEAM_MEMBERS_PAGE_SIZE)
+        manage_teams = request.user.has_perm('teams.manage_teams')
+        html = render_to_string('teams/team_member_list.html', {
+            'object': team,
+            'roster': roster,
+            'manage_teams': manage_teams,
+            'is_team_admin': manage_teams or team.is_admin(request.user),
+        }, request=request)
+        return JsonResponse({'html': html, 'next': roster.next})
+
 class TeamMemberAddView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     model = Team
     object: Team
@@ -152,6 +204,7 @@ class TeamMemberAddView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView)
             return JsonResponse({'success': False, 'html': html})
         return super().form_invalid(form)
 
+    @method_decorator(transaction.atomic)
     def form_valid(self, form):
         if self.request.headers.get('x-requested-with') == 'XMLHttpRequest':
             current_members = self.object.members.all()
@@ -177,6 +230,7 @@ class TeamMemberAddView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView)
 class TeamMemberRemoveView(LoginRequiredMixin, PermissionRequiredMixin, View):
     http_method_names = ('get', )
 
+    @method_decorator(transaction.atomic)
     def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
         team = get_object_or_404(Team, pk=kwargs['pk'])
         member = get_object_or_404(User, pk=kwargs['member'])
@@ -208,6 +262,7 @@ class TeamMemberPromoteView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = 'teams.manage_teams'
     http_method_names = ('get', )
 
+    @method_decorator(transaction.atomic)
     def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
         team = get_object_or_404(Team, pk=kwargs['pk'])
         member = get_object_or_404(User, pk=kwargs['member'])
@@ -236,6 +291,7 @@ class TeamMemberDemoteView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = 'teams.manage_teams'
     http_method_names = ('get', )
 
+    @method_decorator(transaction.atomic)
     def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
         team = get_object_or_404(Team, pk=kwargs['pk'])
         member = get_object_or_404(User, pk=kwargs['member'])
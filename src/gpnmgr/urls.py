@@ -26,6 +26,7 @@ urlpatterns: List[Any] = [
     path('', LandingPageView.as_view(), name='landing_page'),
     path('teams/', include('gpnmgr.teams.urls')),
     path('log/', include('gpnmgr.log.urls')),
+    path('ldap/', include('gpnmgr.ldap.urls')),
     path('user/', include('gpnmgr.accounts.urls')),
     path('i18n/', include('django.conf.urls.i18n')),
 ]